@@ -0,0 +1,170 @@
+import argparse
+import time
+import numpy as np
+
+
+def top_k_rows(scores, k):
+    k = min(k, scores.shape[1])
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+    return np.take_along_axis(part_scores, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+
+def normalize_rows(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+class ExactIndex:
+    # brute force inner product over normalized rows; the reference the other backends are measured against
+    def __init__(self, embeddings, block_size=1024):
+        self.embeddings = normalize_rows(embeddings)
+        self.block_size = block_size
+
+    def search(self, queries, k):
+        queries = normalize_rows(queries)
+        scores, indices = [], []
+        for start in range(0, len(queries), self.block_size):
+            block_scores, block_indices = top_k_rows(queries[start:start + self.block_size] @ self.embeddings.T, k)
+            scores.append(block_scores)
+            indices.append(block_indices)
+        return np.concatenate(scores), np.concatenate(indices)
+
+
+def spherical_kmeans(x, nlist, iters=10, sample_size=256, seed=0):
+    rng = np.random.default_rng(seed)
+    sample = x[np.sort(rng.choice(len(x), min(len(x), nlist * sample_size), replace=False))]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=nlist) == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    # Inverted file index: rows are clustered with spherical k-means and stored contiguously per cluster.
+    # A query scores the nlist centroids and only the rows of the nprobe closest clusters; nprobe trades recall for latency.
+    def __init__(self, embeddings, nlist=0, nprobe=8, iters=10, seed=0, block_size=65536):
+        x = normalize_rows(embeddings)
+        self.nlist = min(len(x), nlist or max(1, int(4 * np.sqrt(len(x)))))
+        self.nprobe = nprobe
+        self.centroids = spherical_kmeans(x, self.nlist, iters, seed=seed)
+
+        assign = np.concatenate([np.argmax(x[start:start + block_size] @ self.centroids.T, axis=1) for start in range(0, len(x), block_size)])
+        self.ids = np.argsort(assign, kind='stable')
+        self.vectors = x[self.ids]
+        self.offsets = np.searchsorted(assign[self.ids], np.arange(self.nlist + 1))
+
+    def search(self, queries, k):
+        queries = normalize_rows(queries)
+        nprobe = min(self.nprobe, self.nlist)
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, (query, probe) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probe])
+            if len(candidates) == 0:
+                continue
+            found_scores, found = top_k_rows((self.vectors[candidates] @ query)[None, :], k)
+            scores[row, :found.shape[1]] = found_scores[0]
+            indices[row, :found.shape[1]] = self.ids[candidates[found[0]]]
+        return scores, indices
+
+
+class HNSWIndex:
+    # graph index from hnswlib (optional dependency); ef_search trades recall for latency
+    def __init__(self, embeddings, m=16, ef_construction=200, ef_search=64, num_threads=-1):
+        import hnswlib
+
+        x = normalize_rows(embeddings)
+        self.ef_search = ef_search
+        self.index = hnswlib.Index(space='ip', dim=x.shape[1])
+        self.index.init_index(max_elements=len(x), ef_construction=ef_construction, M=m)
+        self.index.add_items(x, np.arange(len(x)), num_threads=num_threads)
+
+    def search(self, queries, k):
+        self.index.set_ef(max(self.ef_search, k))
+        labels, distances = self.index.knn_query(normalize_rows(queries), k=k)
+        return 1 - distances, labels.astype(np.int64)
+
+
+def make_index(kind, embeddings, nlist=0, nprobe=8, hnsw_m=16, hnsw_ef_construction=200, hnsw_ef_search=64):
+    if kind == "hnsw":
+        try:
+            return HNSWIndex(embeddings, hnsw_m, hnsw_ef_construction, hnsw_ef_search)
+        except ImportError:
+            print("Warning) hnswlib is not installed, falling back to the exact index")
+            kind = "exact"
+    if kind == "ivf":
+        return IVFIndex(embeddings, nlist, nprobe)
+    if kind == "exact":
+        return ExactIndex(embeddings)
+    raise ValueError(f"unknown ann index: {kind}")
+
+
+def recall_report(index, embeddings, queries, k=10):
+    started = time.perf_counter()
+    _, truth = ExactIndex(embeddings).search(queries, k)
+    exact_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    _, found = index.search(queries, k)
+    index_seconds = time.perf_counter() - started
+
+    recall = np.mean([len(set(expected) & set(got)) / len(expected) for expected, got in zip(truth.tolist(), found.tolist())])
+    return {
+        "index": type(index).__name__,
+        "queries": len(queries),
+        "k": k,
+        f"recall@{k}": round(float(recall), 4),
+        "exact_ms_per_query": round(exact_seconds * 1000 / len(queries), 4),
+        "index_ms_per_query": round(index_seconds * 1000 / len(queries), 4),
+    }
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("approximate nearest neighbor index")
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("--embeddings_path", type=str)
+    parser.add_argument("--query_path", type=str, default="")
+    parser.add_argument("--num_queries", type=int, default=1000)
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--ann_index", type=str, default="ivf", choices=["exact", "ivf", "hnsw"])
+    parser.add_argument("--ann_nlist", type=int, default=0)
+    parser.add_argument("--ann_nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--hnsw_m", type=int, default=16)
+    parser.add_argument("--hnsw_ef_construction", type=int, default=200)
+    parser.add_argument("--hnsw_ef_search", type=int, nargs="+", default=[16, 32, 64, 128])
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == "__main__":
+    opt = parse_option()
+    embeddings = np.load(opt.embeddings_path, mmap_mode='r')
+    if opt.query_path:
+        queries = np.load(opt.query_path)
+    else:
+        # without held-out queries, corpus rows are used (each one is its own nearest neighbor)
+        queries = embeddings[np.sort(np.random.default_rng(0).choice(len(embeddings), min(len(embeddings), opt.num_queries), replace=False))]
+
+    if opt.ann_index == "ivf":
+        index = make_index("ivf", embeddings, opt.ann_nlist)
+        for nprobe in opt.ann_nprobe:
+            index.nprobe = nprobe
+            print(dict(recall_report(index, embeddings, queries, opt.top_k), nlist=index.nlist, nprobe=nprobe))
+    elif opt.ann_index == "hnsw":
+        index = make_index("hnsw", embeddings, hnsw_m=opt.hnsw_m, hnsw_ef_construction=opt.hnsw_ef_construction)
+        for ef_search in opt.hnsw_ef_search:
+            if isinstance(index, HNSWIndex):
+                index.ef_search = ef_search
+            print(dict(recall_report(index, embeddings, queries, opt.top_k), ef_search=ef_search))
+    else:
+        print(recall_report(make_index("exact", embeddings), embeddings, queries, opt.top_k))
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+
+FINAL_STATUSES = ["completed", "failed", "expired", "cancelled"]
+
+
+class OpenAIBatchBackend:
+    def __init__(self, api_key, base_url="https://api.openai.com/v1"):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, path, body=None, content_type="application/json"):
+        import urllib.request
+
+        req = urllib.request.Request(f"{self.base_url}{path}", data=body, method=method)
+        req.add_header("Authorization", f"Bearer {self.api_key}")
+        if body is not None:
+            req.add_header("Content-Type", content_type)
+        with urllib.request.urlopen(req, timeout=600) as response:
+            return response.read()
+
+    def upload(self, path):
+        boundary = uuid.uuid4().hex
+        with open(path, 'rb') as f:
+            content = f.read()
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"purpose\"\r\n\r\nbatch\r\n"
+                f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{os.path.basename(path)}\"\r\n"
+                f"Content-Type: application/jsonl\r\n\r\n").encode('utf-8') + content + f"\r\n--{boundary}--\r\n".encode('utf-8')
+        return json.loads(self.request("POST", "/files", body, f"multipart/form-data; boundary={boundary}"))["id"]
+
+    def submit(self, input_file_id):
+        body = json.dumps({"input_file_id": input_file_id, "endpoint": "/v1/chat/completions", "completion_window": "24h"}).encode('utf-8')
+        return json.loads(self.request("POST", "/batches", body))["id"]
+
+    def status(self, batch_id):
+        return json.loads(self.request("GET", f"/batches/{batch_id}"))
+
+    def download(self, file_id, path):
+        with open(path, 'wb') as f:
+            f.write(self.request("GET", f"/files/{file_id}/content"))
+
+
+def local_responder(body):
+    digest = hashlib.sha256(json.dumps(body["messages"], sort_keys=True).encode('utf-8')).hexdigest()[:8]
+    return json.dumps({"reasoning": "local batch backend", "evidence": f"local evidence {digest}"})
+
+
+class LocalBatchBackend:
+    # file-based stand-in for the Batch API: same upload/submit/status/download cycle, no network
+    def __init__(self, directory, responder=local_responder, polls_until_done=1):
+        self.directory = directory
+        self.responder = responder
+        self.polls_until_done = polls_until_done
+        os.makedirs(os.path.join(directory, "files"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "batches"), exist_ok=True)
+
+    def file_path(self, file_id):
+        return os.path.join(self.directory, "files", file_id)
+
+    def batch_path(self, batch_id):
+        return os.path.join(self.directory, "batches", f"{batch_id}.json")
+
+    def upload(self, path):
+        file_id = f"file-{uuid.uuid4().hex}"
+        shutil.copyfile(path, self.file_path(file_id))
+        return file_id
+
+    def submit(self, input_file_id):
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batch = {"id": batch_id, "status": "in_progress", "input_file_id": input_file_id, "output_file_id": None, "polls": 0}
+        with open(self.batch_path(batch_id), 'w', encoding='utf-8') as f:
+            json.dump(batch, f)
+        return batch_id
+
+    def status(self, batch_id):
+        with open(self.batch_path(batch_id), encoding='utf-8') as f:
+            batch = json.load(f)
+        batch["polls"] += 1
+        if batch["status"] == "in_progress" and batch["polls"] >= self.polls_until_done:
+            # like the Batch API, rows the responder fails on go to a separate error file
+            output_file_id, error_file_id = f"file-{uuid.uuid4().hex}", f"file-{uuid.uuid4().hex}"
+            errors = 0
+            with open(self.file_path(batch["input_file_id"]), encoding='utf-8') as fin, open(self.file_path(output_file_id), 'w', encoding='utf-8') as fout, \
+                    open(self.file_path(error_file_id), 'w', encoding='utf-8') as ferr:
+                for line in fin:
+                    request = json.loads(line)
+                    try:
+                        content = self.responder(request["body"])
+                    except Exception as e:
+                        errors += 1
+                        ferr.write(json.dumps({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"], "response": None,
+                                               "error": {"code": "server_error", "message": str(e)}}) + "\n")
+                        continue
+                    result = {
+                        "id": f"batch_req_{uuid.uuid4().hex}",
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": {"choices": [{"message": {"role": "assistant", "content": content}}],
+                                                                  "usage": {"total_tokens": 0}}},
+                        "error": None,
+                    }
+                    fout.write(json.dumps(result) + "\n")
+            batch["status"] = "completed"
+            batch["output_file_id"] = output_file_id
+            batch["error_file_id"] = error_file_id if errors else None
+        with open(self.batch_path(batch_id), 'w', encoding='utf-8') as f:
+            json.dump(batch, f)
+        return batch
+
+    def download(self, file_id, path):
+        shutil.copyfile(self.file_path(file_id), path)
+
+
+def batch_line(index, messages, model):
+    return json.dumps({"custom_id": str(index), "method": "POST", "url": "/v1/chat/completions",
+                       "body": {"model": model, "messages": messages, "temperature": 0.}}, sort_keys=True) + "\n"
+
+
+def requests_digest(requests, model):
+    # ties batch_state.json to the exact set of (custom_id, body) it was submitted for
+    digest = hashlib.sha256()
+    for line in sorted(batch_line(index, messages, model) for index, messages in requests):
+        digest.update(line.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def write_batch_files(requests, model, work_dir, max_requests_per_file=50000, max_bytes_per_file=150 * 1024 * 1024, prefix="batch_input"):
+    # requests: [(index, messages)]; custom_id is the question index
+    paths, f, count, size = [], None, 0, 0
+    for index, messages in requests:
+        line = batch_line(index, messages, model)
+        if f is None or count >= max_requests_per_file or size + len(line) > max_bytes_per_file:
+            if f is not None:
+                f.close()
+            paths.append(os.path.join(work_dir, f"{prefix}_{len(paths)}.jsonl"))
+            f = open(paths[-1], 'w', encoding='utf-8')
+            count, size = 0, 0
+        f.write(line)
+        count += 1
+        size += len(line.encode('utf-8'))
+    if f is not None:
+        f.close()
+    return paths
+
+
+def read_batch_output(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                print(f"Warning) batch request {result['custom_id']} failed: {result.get('error') or response.get('body')}")
+                yield int(result["custom_id"]), None
+            else:
+                yield int(result["custom_id"]), response["body"]["choices"][0]["message"]["content"]
+
+
+def submit_batches(requests, model, backend, work_dir, state, state_path, attempt=0):
+    prefix = "batch_input" if attempt == 0 else f"batch_input_retry{attempt}"
+    for path in write_batch_files(requests, model, work_dir, prefix=prefix):
+        batch_id = backend.submit(backend.upload(path))
+        state["batches"].append({"id": batch_id, "input": path, "attempt": attempt, "done": False})
+        print(f"### submitted {path} as {batch_id} ###")
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+
+
+def run_batch(requests, model, backend, work_dir, poll_interval=60, max_resubmits=2):
+    # Submits every request, polls until all batches are final and yields (index, content) as results stream in.
+    # Submitted batch ids are kept in work_dir/batch_state.json so a restarted run resumes polling instead of paying twice.
+    # The state only resumes for the same requests, and is marked completed once every batch has been ingested.
+    # Rows that failed inside a batch (error file, or missing from an expired/cancelled batch) are resubmitted up to
+    # max_resubmits times; whatever still fails is yielded as (index, None).
+    os.makedirs(work_dir, exist_ok=True)
+    state_path = os.path.join(work_dir, "batch_state.json")
+    digest = requests_digest(requests, model)
+    state = None
+    if os.path.exists(state_path):
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get("completed"):
+            state = None
+        elif state.get("digest") != digest:
+            print(f"Warning) {state_path} was submitted for different requests; its batches are ignored and the requests submitted anew")
+            state = None
+        else:
+            # nothing was written for the batches of the interrupted run, so all of them are read again
+            for batch in state["batches"]:
+                batch["done"] = False
+            print(f"### resuming {len(state['batches'])} submitted batches ###")
+    if state is None:
+        state = {"digest": digest, "completed": False, "batches": []}
+        submit_batches(requests, model, backend, work_dir, state, state_path)
+
+    succeeded = set()
+    while True:
+        while not all(batch["done"] for batch in state["batches"]):
+            for batch in state["batches"]:
+                if batch["done"]:
+                    continue
+                status = backend.status(batch["id"])
+                if status["status"] not in FINAL_STATUSES:
+                    continue
+                batch["done"] = True
+                for kind in ["output", "error"]:
+                    if status.get(f"{kind}_file_id"):
+                        path = os.path.join(work_dir, f"{batch['id']}_{kind}.jsonl")
+                        backend.download(status[f"{kind}_file_id"], path)
+                        for index, content in read_batch_output(path):
+                            if content is not None and index not in succeeded:
+                                succeeded.add(index)
+                                yield index, content
+                if status["status"] != "completed":
+                    print(f"Warning) batch {batch['id']} ended as {status['status']}")
+            if not all(batch["done"] for batch in state["batches"]):
+                time.sleep(poll_interval)
+
+        failed = [(index, messages) for index, messages in requests if index not in succeeded]
+        attempt = max((batch.get("attempt", 0) for batch in state["batches"]), default=0)
+        if not failed or attempt >= max_resubmits:
+            break
+        print(f"### resubmitting {len(failed)} failed batch requests (retry {attempt + 1} of {max_resubmits}) ###")
+        submit_batches(failed, model, backend, work_dir, state, state_path, attempt + 1)
+
+    for index, _ in failed:
+        yield index, None
+    state["completed"] = True
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
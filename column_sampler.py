@@ -0,0 +1,66 @@
+import sqlite3
+
+
+def read_column_types(cursor, table_name):
+    cursor.execute(f"select name, lower(type) from pragma_table_info('{table_name}');")
+    return {name: column_type for name, column_type in cursor.fetchall()}
+
+
+def scan_columns(cursor, table_name, column_names, scan_limit, max_length):
+    if max_length is None:
+        select_list = ", ".join([f"`{column_name}`" for column_name in column_names])
+    else:
+        select_list = ", ".join([f"substr(`{column_name}`,1,{max_length})" for column_name in column_names])
+    cursor.execute(f"SELECT {select_list} FROM `{table_name}` limit {scan_limit};")
+    return cursor
+
+
+def scan_each_column(cursor, table_name, scan_names, num_of_sampling, scan_limit, max_length, null_value):
+    samples = {}
+    for name in scan_names:
+        try:
+            column_samples = {}
+            for (value,) in scan_columns(cursor, table_name, [name], scan_limit, max_length):
+                if len(column_samples) < num_of_sampling:
+                    column_samples.setdefault(null_value if value is None else value, None)
+            samples[name] = column_samples
+        except sqlite3.Error:
+            continue
+    return samples
+
+
+def sample_table_values(cursor, table_name, column_names, num_of_sampling, scan_limit=1000, max_length=100, null_value=None,
+                        skip_blobs=True, per_column=False):
+    # Distinct value samples for every requested column from one bounded scan of the table.
+    # Columns that do not exist or are declared as BLOB get no entry in the result.
+    # max_length=None, skip_blobs=False and per_column=True reproduce the per-column queries of p26/p27: whole values,
+    # BLOB columns kept, and one scan per column, which SQLite may serve from a covering index in another row order.
+    column_types = read_column_types(cursor, table_name)
+    canonical_names = {name.lower(): name for name in column_types}
+
+    resolved = {}
+    for column_name in column_names:
+        canonical_name = canonical_names.get(column_name.lower())
+        if canonical_name is not None and (column_types[canonical_name] != "blob" or not skip_blobs):
+            resolved[column_name] = canonical_name
+
+    scan_names = list(dict.fromkeys(resolved.values()))
+    if not scan_names:
+        return {}
+
+    if per_column:
+        samples = scan_each_column(cursor, table_name, scan_names, num_of_sampling, scan_limit, max_length, null_value)
+        return {column_name: list(samples[name]) for column_name, name in resolved.items() if name in samples}
+
+    samples = {name: {} for name in scan_names}
+    try:
+        for row in scan_columns(cursor, table_name, scan_names, scan_limit, max_length):
+            for name, value in zip(scan_names, row):
+                column_samples = samples[name]
+                if len(column_samples) < num_of_sampling:
+                    column_samples.setdefault(null_value if value is None else value, None)
+    except sqlite3.Error:
+        # fall back to one scan per column so a single bad column does not drop the whole table
+        samples = scan_each_column(cursor, table_name, scan_names, num_of_sampling, scan_limit, max_length, null_value)
+
+    return {column_name: list(samples[name]) for column_name, name in resolved.items() if name in samples}
@@ -0,0 +1,100 @@
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+
+
+def corpus_hash(questions, db_ids, evidences):
+    digest = hashlib.sha256()
+    for record in zip(questions, db_ids, evidences):
+        digest.update(json.dumps(record, ensure_ascii=False).encode('utf-8'))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def index_key(model_name, task, corpus_digest):
+    return hashlib.sha256(json.dumps([model_name, task, corpus_digest]).encode('utf-8')).hexdigest()[:24]
+
+
+class EmbeddingIndex:
+    # normalized float32 train embeddings in <key>.npy (memory-mapped on load) and the matching rows in <key>.json
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        os.makedirs(index_dir, exist_ok=True)
+
+    def paths(self, key):
+        return os.path.join(self.index_dir, f"{key}.npy"), os.path.join(self.index_dir, f"{key}.json")
+
+    def load(self, key):
+        npy_path, meta_path = self.paths(key)
+        if not (os.path.exists(npy_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        # copy-on-write keeps the file read-only on disk while giving torch a writable array
+        embeddings = np.load(npy_path, mmap_mode='c')
+        if embeddings.shape != (meta["count"], meta["dim"]):
+            print(f"Warning) embedding index {key} is inconsistent, rebuilding")
+            return None
+        return embeddings, meta
+
+    def save(self, key, embeddings, meta):
+        npy_path, meta_path = self.paths(key)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        meta = dict(meta, count=embeddings.shape[0], dim=embeddings.shape[1])
+        # the .npy goes first and the metadata last, so a half-written index is never picked up
+        with open(npy_path + ".tmp", 'wb') as f:
+            np.save(f, embeddings)
+        os.replace(npy_path + ".tmp", npy_path)
+        with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def entries(self):
+        for name in sorted(os.listdir(self.index_dir)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.index_dir, name), encoding='utf-8') as f:
+                    meta = json.load(f)
+                yield os.path.splitext(name)[0], meta
+
+
+def load_or_build(index_dir, model_name, task, questions, db_ids, evidences, encode_fn):
+    # encode_fn(questions) -> float32 array of normalized embeddings; only called on a miss
+    index = EmbeddingIndex(index_dir)
+    digest = corpus_hash(questions, db_ids, evidences)
+    key = index_key(model_name, task, digest)
+    loaded = index.load(key)
+    if loaded is not None:
+        print(f"### embedding index {key}: {loaded[0].shape[0]} rows mapped ###")
+        return loaded[0]
+
+    embeddings = encode_fn(questions)
+    index.save(key, embeddings, {
+        "model_name": model_name,
+        "task": task,
+        "corpus_hash": digest,
+        "questions": questions,
+        "db_ids": db_ids,
+        "evidences": evidences,
+    })
+    print(f"### embedding index {key}: built {len(questions)} rows ###")
+    return index.load(key)[0]
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("train question embedding index")
+    parser.add_argument("command", choices=["inspect"])
+    parser.add_argument("--embedding_index_dir", type=str)
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == "__main__":
+    opt = parse_option()
+
+    if opt.command == "inspect":
+        for key, meta in EmbeddingIndex(opt.embedding_index_dir).entries():
+            print(f"{key}: {meta['model_name']} task={meta['task'] or '-'} rows={meta['count']} dim={meta['dim']} corpus={meta['corpus_hash'][:12]}")
@@ -0,0 +1,327 @@
+import argparse
+import json
+import math
+import os
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+STAGES = ["schema", "retrieval", "prompt", "llm", "parse", "total"]
+
+
+def percentile(values, q):
+    # nearest rank on a sorted copy; fine for the few thousand samples a window holds
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+class EvidenceClient:
+    # for the text-to-SQL serving path; stdlib only like RetrievalClient
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def request(self, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = urllib.request.Request(f"{self.url}{path}", data=data, method="POST" if data else "GET")
+        req.add_header("Content-Type", "application/json")
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def generate_evidence(self, question, db_id, timeout=None):
+        body = {"question": question, "db_id": db_id}
+        if timeout is not None:
+            body["timeout"] = timeout
+        return self.request("/evidence", body)
+
+    def health(self):
+        return self.request("/health")
+
+    def metrics(self):
+        return self.request("/metrics")
+
+
+class LatencyMetrics:
+    # per-stage latencies over a sliding window of the most recent requests
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.samples = {stage: deque(maxlen=window) for stage in STAGES}
+        # abandoned: generations that were still running when every caller waiting on them had timed out
+        self.counts = {"requests": 0, "generated": 0, "coalesced": 0, "timeouts": 0, "errors": 0, "abandoned": 0}
+
+    def record(self, timings):
+        with self.lock:
+            for stage, seconds in timings.items():
+                self.samples[stage].append(seconds)
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def snapshot(self):
+        with self.lock:
+            samples = {stage: list(values) for stage, values in self.samples.items()}
+            counts = dict(self.counts)
+        stages = {}
+        for stage, values in samples.items():
+            stages[stage] = {"count": len(values)}
+            for q in [50, 95, 99]:
+                value = percentile(values, q)
+                stages[stage][f"p{q}_ms"] = round(value * 1000, 1) if value is not None else None
+        return dict(counts, stages=stages)
+
+
+class EvidenceService:
+    # Warm state for online generate_evidence calls: the retrieval index and the schema contexts are loaded
+    # once at startup, identical concurrent requests share one generation, and callers stop waiting after a timeout.
+    def __init__(self, opt):
+        import make_evidence
+        from make_evidence import SimilarQuestionFinder, build_schema_context
+        from schema_cache import SchemaContextCache
+        from schema_store import SchemaStore
+        from prepare import load_schema_contexts
+        from rate_limiter import shared_limiter
+        from retry_policy import shared_policy
+        from response_cache import shared_cache
+        from llm_backend import make_backend
+        from prompt_budget import PromptBudgeter
+        from text_encoding import read_text
+
+        self.opt = opt
+        self.me = make_evidence
+        make_evidence.llm = make_backend(opt.llm_backend, opt.openai_api_key, opt.llm_base_url, opt.mock_latency, opt.mock_error_rate)
+        shared_limiter.configure(opt.rpm, opt.tpm)
+        shared_policy.configure(opt.max_attempts, opt.max_retry_seconds)
+        if opt.response_cache_path:
+            shared_cache.open(opt.response_cache_path, opt.response_cache_max_mb * 1024 * 1024, opt.response_cache_readonly)
+
+        started = time.time()
+        if opt.retrieval_server:
+            from retrieval_server import RetrievalClient
+            self.finder = RetrievalClient(opt.retrieval_server)
+        else:
+            text, _ = read_text(opt.train_json_path)
+            ann_options = {"nlist": opt.ann_nlist, "nprobe": opt.ann_nprobe, "hnsw_ef_search": opt.hnsw_ef_search}
+            self.finder = SimilarQuestionFinder(json.loads(text), opt.embedding_model_name, opt.embedding_index_dir, opt.embedding_task, opt.ann_index, ann_options,
+                                                opt.retrieval, opt.lexical_index_dir, opt.bm25_include_evidence, opt.fusion, opt.fusion_alpha)
+        self.retrieval_lock = threading.Lock()
+
+        schema_store = SchemaStore(opt.schema_store_path) if opt.schema_store_path else None
+        self.schema_cache = SchemaContextCache(build_schema_context, opt.schema_cache_size or None, store=schema_store, variant="make_evidence")
+        if opt.schema_context_path:
+            self.schema_cache.preload(load_schema_contexts(opt.schema_context_path, self.schema_cache.variant))
+        self.db_ids = self.warm_schemas()
+        self.budgeter = PromptBudgeter(opt.gpt_model, opt.reserved_output_tokens)
+        print(f"### evidence server: {len(self.db_ids)} databases and the retrieval index ready in {time.time() - started:.1f}s ###")
+
+        self.metrics = LatencyMetrics(opt.metrics_window)
+        self.executor = ThreadPoolExecutor(max_workers=opt.concurrency)
+        self.lock = threading.RLock()
+        self.inflight = {}
+        self.deadlines = {}
+
+    def warm_schemas(self):
+        # every question database (30 value examples) and every few-shot database (5), as build_prompt asks for them
+        db_ids = []
+        for db_root, num_of_sampling in [(self.opt.db_path, 30), (self.opt.train_db_path, 5)]:
+            for db_id in sorted(os.listdir(db_root)) if db_root else []:
+                if os.path.isfile(f"{db_root}/{db_id}/{db_id}.sqlite"):
+                    self.schema_cache.get(db_root, db_id, num_of_sampling)
+                    if db_root == self.opt.db_path:
+                        db_ids.append(db_id)
+        return set(db_ids)
+
+    def generate(self, question, db_id):
+        me, opt = self.me, self.opt
+        key = (db_id, question)
+        timings = {}
+        started = last = time.perf_counter()
+
+        def lap(stage):
+            nonlocal last
+            now = time.perf_counter()
+            timings[stage] = now - last
+            last = now
+
+        self.schema_cache.get(opt.db_path, db_id, 30)
+        lap("schema")
+        with self.retrieval_lock:
+            similar = self.finder.find_similar_questions_batch([question], opt.top_n, opt.retrieval_batch_size, opt.retrieval_block_size)[0]
+        lap("retrieval")
+        prompt = self.budgeter.fit(me.build_prompt({"question": question, "db_id": db_id}, self.finder, self.schema_cache, opt, similar))
+        lap("prompt")
+        with self.lock:
+            deadline = self.deadlines[key]
+        if time.monotonic() >= deadline:
+            # nobody is waiting anymore; a later caller starts a fresh generation
+            self.metrics.count("abandoned")
+            raise FutureTimeoutError(f"deadline passed before the LLM call for {key}")
+        response = me.request_reply(prompt, opt.gpt_model, deadline)
+        lap("llm")
+        if response is None:
+            evidence = "Warning) No response from API"
+        else:
+            evidence = str(me.extract_evidence(response)).replace('\n', ', ')
+        lap("parse")
+
+        timings["total"] = time.perf_counter() - started
+        self.metrics.record({stage: seconds for stage, seconds in timings.items() if stage != "total"})
+        self.metrics.count("generated")
+        with self.lock:
+            if time.monotonic() >= self.deadlines[key]:
+                # the answer still lands in the response cache, but its callers are gone
+                self.metrics.count("abandoned")
+        return {"question": question, "db_id": db_id, "evidence": evidence, "latency_ms": {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}}
+
+    def forget(self, key, future):
+        with self.lock:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+                del self.deadlines[key]
+
+    def generate_evidence(self, question, db_id, timeout=None):
+        if db_id not in self.db_ids:
+            raise KeyError(f"unknown db_id {db_id}")
+        timeout = min(float(timeout), self.opt.timeout) if timeout else self.opt.timeout
+        self.metrics.count("requests")
+        started = time.perf_counter()
+        key = (db_id, question)
+        with self.lock:
+            future = self.inflight.get(key)
+            coalesced = future is not None
+            # the generation gives up its retries once the latest of its callers has stopped waiting
+            self.deadlines[key] = max(self.deadlines.get(key, 0.), time.monotonic() + timeout)
+            if future is None:
+                future = self.executor.submit(self.generate, question, db_id)
+                self.inflight[key] = future
+                future.add_done_callback(lambda done: self.forget(key, done))
+        if coalesced:
+            self.metrics.count("coalesced")
+
+        try:
+            # a timed out generation finishes its current LLM call, but retries stop at the deadline (see generate)
+            result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.metrics.count("timeouts")
+            raise
+        except Exception:
+            self.metrics.count("errors")
+            raise
+        self.metrics.record({"total": time.perf_counter() - started})
+        return dict(result, coalesced=coalesced)
+
+    def health(self):
+        return {"status": "ok", "databases": len(self.db_ids), "schema_cache": self.schema_cache.stats(), "inflight": len(self.inflight)}
+
+
+class EvidenceHTTPServer(ThreadingHTTPServer):
+    # the default backlog of 5 makes bursts of callers wait for a SYN retry (~1s) before they are even accepted
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def make_handler(service):
+    class EvidenceHandler(BaseHTTPRequestHandler):
+        def reply(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self.reply(200, service.health())
+            elif self.path == "/metrics":
+                self.reply(200, service.metrics.snapshot())
+            else:
+                self.reply(404, {"error": f"unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/evidence":
+                self.reply(404, {"error": f"unknown path {self.path}"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                self.reply(200, service.generate_evidence(body["question"], body["db_id"], body.get("timeout")))
+            except FutureTimeoutError:
+                self.reply(504, {"error": "evidence generation timed out"})
+            except (KeyError, TypeError, ValueError) as e:
+                self.reply(400, {"error": str(e)})
+            except Exception as e:
+                self.reply(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return EvidenceHandler
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("online evidence generation server")
+    parser.add_argument("--train_json_path", type=str)
+    parser.add_argument("--db_path", type=str)
+    parser.add_argument("--train_db_path", type=str)
+    parser.add_argument("--top_n", type=int, default=5)
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=60.)
+    parser.add_argument("--metrics_window", type=int, default=10000)
+    parser.add_argument("--gpt_model", type=str, default="gpt-4o")
+    parser.add_argument("--embedding_model_name", type=str, default="sentence-transformers/all-mpnet-base-v2")
+    parser.add_argument("--openai_api_key", type=str, default="")
+    parser.add_argument("--llm_backend", type=str, default="openai", choices=["openai", "openai_compatible", "mock"])
+    parser.add_argument("--llm_base_url", type=str, default="")
+    parser.add_argument("--mock_latency", type=float, default=0.)
+    parser.add_argument("--mock_error_rate", type=float, default=0.)
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--tpm", type=int, default=0)
+    parser.add_argument("--max_attempts", type=int, default=8)
+    parser.add_argument("--max_retry_seconds", type=float, default=600.)
+    parser.add_argument("--response_cache_path", type=str, default="")
+    parser.add_argument("--response_cache_max_mb", type=int, default=1024)
+    parser.add_argument("--response_cache_readonly", action="store_true")
+    parser.add_argument("--reserved_output_tokens", type=int, default=4096)
+    parser.add_argument("--schema_cache_size", type=int, default=0)
+    parser.add_argument("--schema_store_path", type=str, default="")
+    parser.add_argument("--schema_context_path", type=str, default="")
+    parser.add_argument("--retrieval_server", type=str, default="")
+    parser.add_argument("--retrieval_batch_size", type=int, default=256)
+    parser.add_argument("--retrieval_block_size", type=int, default=1024)
+    parser.add_argument("--embedding_index_dir", type=str, default="")
+    parser.add_argument("--embedding_task", type=str, default="")
+    parser.add_argument("--ann_index", type=str, default="exact", choices=["exact", "ivf", "hnsw"])
+    parser.add_argument("--ann_nlist", type=int, default=0)
+    parser.add_argument("--ann_nprobe", type=int, default=8)
+    parser.add_argument("--hnsw_ef_search", type=int, default=64)
+    parser.add_argument("--retrieval", type=str, default="dense", choices=["dense", "hybrid", "lexical"])
+    parser.add_argument("--lexical_index_dir", type=str, default="")
+    parser.add_argument("--bm25_include_evidence", action="store_true")
+    parser.add_argument("--fusion", type=str, default="rrf", choices=["rrf", "weighted"])
+    parser.add_argument("--fusion_alpha", type=float, default=0.5)
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == "__main__":
+    opt = parse_option()
+    service = EvidenceService(opt)
+
+    server = EvidenceHTTPServer((opt.host, opt.port), make_handler(service))
+    print(f"### evidence server listening on http://{opt.host}:{opt.port} ###")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
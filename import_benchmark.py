@@ -0,0 +1,77 @@
+import argparse
+import glob
+import subprocess
+import sys
+import time
+
+
+HEAVY_MODULES = ["torch", "sentence_transformers", "transformers", "openai", "tqdm", "charset_normalizer", "tiktoken", "numpy"]
+
+
+def parse_importtime(stderr):
+    # lines look like "import time:       123 |        456 |   package"; nesting is two spaces per level
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name[1:]
+        imports.append((name.strip(), len(name) - len(name.lstrip()) == 0, int(self_us), int(cumulative_us)))
+    return imports
+
+
+def measure(script, script_args, repeat=3):
+    # cold start = a fresh interpreter each time; the fastest of the runs is kept to cut scheduler noise
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", script] + script_args, capture_output=True, text=True)
+        wall_ms = (time.perf_counter() - started) * 1000
+        imports = parse_importtime(result.stderr)
+        run = {
+            "script": script,
+            "returncode": result.returncode,
+            "wall_ms": round(wall_ms, 1),
+            "import_ms": round(sum(cumulative for _, top_level, _, cumulative in imports if top_level) / 1000, 1),
+            "heavy": sorted({name.split(".")[0] for name, _, _, _ in imports if name.split(".")[0] in HEAVY_MODULES}),
+            "slowest": sorted(((name, round(cumulative / 1000, 1)) for name, top_level, _, cumulative in imports if top_level), key=lambda item: -item[1])[:5],
+        }
+        if best is None or run["import_ms"] < best["import_ms"]:
+            best = run
+    return best
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("cold startup import benchmark")
+    parser.add_argument("--scripts", type=str, nargs="*", default=["make_evidence.py"])
+    parser.add_argument("--all", action="store_true")
+    parser.add_argument("--script_args", type=str, nargs="*", default=["--help"])
+    parser.add_argument("--budget_ms", type=float, default=100.)
+    parser.add_argument("--allow_heavy", action="store_true")
+    parser.add_argument("--repeat", type=int, default=3)
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == "__main__":
+    opt = parse_option()
+    scripts = sorted(glob.glob("make_evidence*.py")) if opt.all else opt.scripts
+
+    failed = []
+    for script in scripts:
+        run = measure(script, opt.script_args, opt.repeat)
+        print(f"{run['script']}: imports {run['import_ms']}ms, wall {run['wall_ms']}ms, slowest {run['slowest']}")
+        if run["returncode"] != 0:
+            failed.append(script)
+            print(f"Warning) {script} exited with {run['returncode']}")
+        if run["import_ms"] > opt.budget_ms:
+            failed.append(script)
+            print(f"Warning) {script} imports take {run['import_ms']}ms, over the {opt.budget_ms}ms budget")
+        if run["heavy"] and not opt.allow_heavy:
+            failed.append(script)
+            print(f"Warning) {script} imports heavy modules on startup: {', '.join(run['heavy'])}")
+
+    print(f"### {len(scripts) - len(set(failed))} / {len(scripts)} scripts within budget ###")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,170 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+import numpy as np
+from embedding_index import corpus_hash
+
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it", "of", "on", "or",
+    "that", "the", "their", "there", "this", "to", "was", "were", "what", "when", "where", "which", "who", "with",
+}
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+")
+CAMEL_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+
+def stem(token):
+    # plural folding only ("customers" -> "customer"); enough for column names without pulling in a stemmer
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-3] + "y" if token.endswith("ies") else token[:-1]
+    return token
+
+
+def tokenize(text):
+    # "CustomerID" and "customer_id" both give "customer", "id"; the unsplit identifier is kept too so exact names still score higher
+    tokens = []
+    for word in TOKEN_PATTERN.findall(text):
+        parts = [part.lower() for part in CAMEL_PATTERN.findall(word)]
+        if word.lower() not in STOPWORDS:
+            tokens.append(stem(word.lower()))
+        if len(parts) > 1:
+            tokens += [stem(part) for part in parts if part not in STOPWORDS]
+    return tokens
+
+
+class BM25Index:
+    # Inverted index with the BM25 weight of every posting precomputed, so a query is a few numpy scatter-adds.
+    def __init__(self, terms, offsets, doc_ids, weights, doc_count):
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.doc_count = doc_count
+
+    @classmethod
+    def build(cls, documents, k1=1.5, b=0.75):
+        postings = defaultdict(list)
+        doc_lengths = np.zeros(len(documents), dtype=np.float32)
+        for doc_id, document in enumerate(documents):
+            counts = Counter(tokenize(document))
+            doc_lengths[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                postings[term].append((doc_id, tf))
+
+        avg_length = max(float(doc_lengths.mean()) if len(documents) else 0., 1.)
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_ids, weights = [], []
+        for i, term in enumerate(terms):
+            ids = np.array([doc_id for doc_id, _ in postings[term]], dtype=np.int32)
+            tf = np.array([tf for _, tf in postings[term]], dtype=np.float32)
+            idf = np.log(1 + (len(documents) - len(ids) + 0.5) / (len(ids) + 0.5))
+            doc_ids.append(ids)
+            weights.append((idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_lengths[ids] / avg_length))).astype(np.float32))
+            offsets[i + 1] = offsets[i] + len(ids)
+        return cls(terms, offsets,
+                   np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int32),
+                   np.concatenate(weights) if weights else np.zeros(0, dtype=np.float32),
+                   len(documents))
+
+    def scores(self, query):
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        for term in tokenize(query):
+            term_id = self.term_ids.get(term)
+            if term_id is not None:
+                start, end = self.offsets[term_id], self.offsets[term_id + 1]
+                scores[self.doc_ids[start:end]] += self.weights[start:end]
+        return scores
+
+    def search(self, query, k):
+        scores = self.scores(query)
+        k = min(k, self.doc_count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return scores[top].tolist(), top.tolist()
+
+    def save(self, path):
+        with open(path + ".tmp", 'wb') as f:
+            np.savez(f, terms=np.array(self.terms, dtype=str), offsets=self.offsets, doc_ids=self.doc_ids, weights=self.weights, doc_count=self.doc_count)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["terms"].tolist(), data["offsets"], data["doc_ids"], data["weights"], int(data["doc_count"]))
+
+
+def load_or_build(index_dir, questions, db_ids, evidences, include_evidence=False, k1=1.5, b=0.75):
+    documents = [f"{question} {evidence}" if include_evidence else question for question, evidence in zip(questions, evidences)]
+    if not index_dir:
+        return BM25Index.build(documents, k1, b)
+
+    os.makedirs(index_dir, exist_ok=True)
+    key = hashlib.sha256(json.dumps([corpus_hash(questions, db_ids, evidences), include_evidence, k1, b]).encode('utf-8')).hexdigest()[:24]
+    path = os.path.join(index_dir, f"bm25_{key}.npz")
+    if os.path.exists(path):
+        print(f"### lexical index {key}: loaded ###")
+        return BM25Index.load(path)
+    index = BM25Index.build(documents, k1, b)
+    index.save(path)
+    print(f"### lexical index {key}: built {len(documents)} documents, {len(index.terms)} terms ###")
+    return index
+
+
+def fuse(dense, lexical, top_k, method="rrf", alpha=0.5, rrf_k=60):
+    # dense / lexical: [(train index, score)] best first; lexical hits with a zero score carry no signal and are skipped,
+    # as are the (-1, -inf) slots an IVF search pads with when its probed clusters hold fewer than k vectors
+    dense = [(idx, score) for idx, score in dense if idx >= 0 and math.isfinite(score)]
+    lexical = [(idx, score) for idx, score in lexical if idx >= 0 and score > 0]
+    fused = defaultdict(float)
+    if method == "rrf":
+        for ranking in (dense, lexical):
+            for rank, (idx, _) in enumerate(ranking):
+                fused[idx] += 1 / (rrf_k + rank + 1)
+    elif method == "weighted":
+        for ranking, weight in ((dense, alpha), (lexical, 1 - alpha)):
+            if not ranking:
+                continue
+            low, high = min(score for _, score in ranking), max(score for _, score in ranking)
+            for idx, score in ranking:
+                fused[idx] += weight * ((score - low) / (high - low) if high > low else 1.)
+    else:
+        raise ValueError(f"unknown fusion method: {method}")
+    return sorted(fused, key=lambda idx: (-fused[idx], idx))[:top_k]
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("bm25 index over train questions")
+    parser.add_argument("command", choices=["search"])
+    parser.add_argument("--train_json_path", type=str)
+    parser.add_argument("--lexical_index_dir", type=str, default="")
+    parser.add_argument("--bm25_include_evidence", action="store_true")
+    parser.add_argument("--query", type=str)
+    parser.add_argument("--top_k", type=int, default=5)
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == "__main__":
+    from text_encoding import read_text
+    from make_evidence import filter_train_data
+
+    opt = parse_option()
+    text, _ = read_text(opt.train_json_path)
+    train_data = filter_train_data(json.loads(text))
+    questions = [item["question"] for item in train_data]
+    db_ids = [item["db_id"] for item in train_data]
+    evidences = [item["evidence"] for item in train_data]
+
+    if opt.command == "search":
+        index = load_or_build(opt.lexical_index_dir, questions, db_ids, evidences, opt.bm25_include_evidence)
+        for score, idx in zip(*index.search(opt.query, opt.top_k)):
+            print(f"{score:.3f}  [{db_ids[idx]}] {questions[idx]}")
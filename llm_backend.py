@@ -0,0 +1,125 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import namedtuple
+from retry_policy import classify_error, RATE_LIMIT, TRANSIENT, CONTEXT_OVERFLOW
+
+
+ChatResult = namedtuple("ChatResult", ["content", "usage"])
+
+
+class LLMError(Exception):
+    # http_status and error_name keep what the client library raised, so the retry policy can still tell
+    # an account-level failure (bad key, no permission) from one that only concerns this request
+    def __init__(self, message, headers=None, http_status=None, error_name=None):
+        super().__init__(message)
+        self.headers = headers or {}
+        self.http_status = http_status
+        self.error_name = error_name or type(self).__name__
+
+
+class RateLimitError(LLMError):
+    pass
+
+
+class TransientError(LLMError):
+    pass
+
+
+class ContextOverflowError(LLMError):
+    pass
+
+
+class FatalError(LLMError):
+    pass
+
+
+class LLMBackend:
+    def chat(self, messages, model, temperature=0.):
+        raise NotImplementedError
+
+
+class OpenAIBackend(LLMBackend):
+    def __init__(self, api_key, base_url=None):
+        self.api_key = api_key
+        self.base_url = base_url
+
+    def chat(self, messages, model, temperature=0.):
+        import openai
+
+        kwargs = {"api_key": self.api_key}
+        if self.base_url:
+            kwargs["api_base"] = self.base_url
+        try:
+            completions = openai.ChatCompletion.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                **kwargs
+            )
+        except Exception as e:
+            error_type = {RATE_LIMIT: RateLimitError, TRANSIENT: TransientError, CONTEXT_OVERFLOW: ContextOverflowError}.get(classify_error(e), FatalError)
+            raise error_type(str(e), getattr(e, "headers", None), getattr(e, "http_status", None) or getattr(e, "status_code", None), type(e).__name__) from e
+
+        usage = getattr(completions, "usage", None) or {}
+        return ChatResult(completions.choices[0].message.content, {
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+        })
+
+
+class OpenAICompatibleBackend(OpenAIBackend):
+    # any server speaking the OpenAI chat completions API (vLLM, llama.cpp, TGI, ...)
+    def __init__(self, base_url, api_key="EMPTY"):
+        super().__init__(api_key, base_url)
+
+
+def mock_responder(messages):
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+    return json.dumps({"reasoning": "mock backend", "evidence": f"mock evidence {digest}"})
+
+
+class MockBackend(LLMBackend):
+    # in-process fake with configurable latency and error injection, for offline load testing
+    def __init__(self, latency=0., latency_jitter=0., error_rate=0., rate_limit_rate=0., context_window=None, seed=0, responder=mock_responder):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.context_window = context_window
+        self.responder = responder
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def chat(self, messages, model, temperature=0.):
+        with self.lock:
+            self.calls += 1
+            draw = self.random.random()
+            delay = self.latency + self.random.uniform(0, self.latency_jitter)
+        time.sleep(delay)
+
+        prompt_tokens = sum(len(message["content"]) // 4 + 4 for message in messages) + 3
+        if self.context_window is not None and prompt_tokens > self.context_window:
+            raise ContextOverflowError(f"This model's maximum context length is {self.context_window} tokens. However, your messages resulted in {prompt_tokens} tokens.")
+        if draw < self.rate_limit_rate:
+            raise RateLimitError("mock rate limit", {"retry-after": "0.1"})
+        if draw < self.rate_limit_rate + self.error_rate:
+            raise TransientError("mock server error")
+
+        content = self.responder(messages)
+        completion_tokens = len(content) // 4 + 1
+        return ChatResult(content, {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens})
+
+
+def make_backend(name, api_key="", base_url="", mock_latency=0., mock_error_rate=0.):
+    if name == "openai":
+        return OpenAIBackend(api_key, base_url or None)
+    if name == "openai_compatible":
+        return OpenAICompatibleBackend(base_url, api_key or "EMPTY")
+    if name == "mock":
+        return MockBackend(latency=mock_latency, error_rate=mock_error_rate)
+    raise ValueError(f"unknown llm backend: {name}")
@@ -0,0 +1,56 @@
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+
+async def run_engine(items, build_fn, request_fn, result_fn, concurrency=8, prefetch=None):
+    # build_fn(item) -> request, request_fn(request) -> response, result_fn(index, item, request, response).
+    # Requests are built one at a time ahead of the senders so schema/prompt work overlaps network waits;
+    # result_fn is always called in the order of items.
+    loop = asyncio.get_running_loop()
+    prefetch = prefetch or concurrency * 2
+    queue = asyncio.Queue(maxsize=prefetch)
+    build_executor = ThreadPoolExecutor(max_workers=1)
+    request_executor = ThreadPoolExecutor(max_workers=concurrency)
+    reorder_buffer = {}
+    next_index = 0
+
+    async def produce():
+        for index, item in enumerate(items):
+            request = await loop.run_in_executor(build_executor, build_fn, item)
+            await queue.put((index, item, request))
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def send():
+        nonlocal next_index
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            index, item, request = job
+            if inspect.iscoroutinefunction(request_fn):
+                response = await request_fn(request)
+            else:
+                response = await loop.run_in_executor(request_executor, request_fn, request)
+
+            reorder_buffer[index] = (item, request, response)
+            while next_index in reorder_buffer:
+                item, request, response = reorder_buffer.pop(next_index)
+                result_fn(next_index, item, request, response)
+                next_index += 1
+
+    tasks = [asyncio.ensure_future(produce())] + [asyncio.ensure_future(send()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        build_executor.shutdown(wait=False)
+        request_executor.shutdown(wait=False)
+
+
+def run_ordered(items, build_fn, request_fn, result_fn, concurrency=8, prefetch=None):
+    asyncio.run(run_engine(items, build_fn, request_fn, result_fn, concurrency, prefetch))
@@ -0,0 +1,116 @@
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from evidence_server import EvidenceClient, percentile
+from text_encoding import read_text
+
+
+def make_workload(dataset, requests, duplicate_rate, seed=0):
+    # replays dev questions; a share of the requests repeats a recent question so coalescing gets exercised
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(requests):
+        if workload and rng.random() < duplicate_rate:
+            workload.append(rng.choice(workload[-32:]))
+        else:
+            data = rng.choice(dataset)
+            workload.append((data["question"], data["db_id"]))
+    return workload
+
+
+def start_server(opt):
+    command = [sys.executable, "evidence_server.py", "--llm_backend", "mock", "--mock_latency", str(opt.mock_latency),
+               "--port", str(opt.port)] + opt.server_args
+    process = subprocess.Popen(command)
+    client = EvidenceClient(f"http://127.0.0.1:{opt.port}", timeout=5)
+    deadline = time.time() + opt.startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"evidence server exited with {process.returncode}")
+        try:
+            client.health()
+            return process
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"evidence server not ready after {opt.startup_timeout}s")
+
+
+def run(client, workload, concurrency, timeout):
+    def call(job):
+        question, db_id = job
+        started = time.perf_counter()
+        try:
+            result = client.generate_evidence(question, db_id, timeout)
+            status = 200
+        except urllib.error.HTTPError as e:
+            result, status = None, e.code
+        except OSError:
+            result, status = None, "connection"
+        return status, time.perf_counter() - started, result
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, workload))
+    return results, time.perf_counter() - started
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("load test for evidence_server.py")
+    parser.add_argument("--url", type=str, default="")
+    parser.add_argument("--dataset_json_path", type=str)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duplicate_rate", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output_path", type=str, default="")
+    # without --url a server is started here on the mock LLM backend; --server_args go to evidence_server.py
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--mock_latency", type=float, default=0.5)
+    parser.add_argument("--startup_timeout", type=float, default=600.)
+    parser.add_argument("--server_args", type=str, nargs=argparse.REMAINDER, default=[])
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == "__main__":
+    opt = parse_option()
+    print(opt)
+
+    text, _ = read_text(opt.dataset_json_path)
+    workload = make_workload(json.loads(text), opt.requests, opt.duplicate_rate, opt.seed)
+    process = start_server(opt) if not opt.url else None
+    client = EvidenceClient(opt.url or f"http://127.0.0.1:{opt.port}", timeout=opt.timeout + 10 if opt.timeout else 600)
+
+    try:
+        results, elapsed = run(client, workload, opt.concurrency, opt.timeout)
+        server_metrics = client.metrics()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    latencies = [seconds for status, seconds, _ in results if status == 200]
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    report = {
+        "requests": len(results),
+        "concurrency": opt.concurrency,
+        "throughput_rps": round(len(results) / elapsed, 1),
+        "statuses": statuses,
+        "client_ms": {f"p{q}": round(percentile(latencies, q) * 1000, 1) if latencies else None for q in [50, 95, 99]},
+        "server": server_metrics,
+    }
+    print(json.dumps(report, indent=2))
+    if opt.output_path:
+        with open(opt.output_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
@@ -1,16 +1,27 @@
 import json
 import argparse
-import openai
-from tqdm import tqdm
 import sqlite3
 import os
-import time
+import sys
 import csv
-from sentence_transformers import SentenceTransformer
-import torch
+import io
 import re
-from charset_normalizer import detect
-
+from schema_cache import SchemaContextCache
+from text_encoding import read_text
+from column_sampler import sample_table_values
+from schema_store import SchemaStore
+from prepare import load_schema_contexts
+from rate_limiter import shared_limiter, estimate_tokens
+from retry_policy import shared_policy, RetryExhausted
+from response_cache import shared_cache
+from llm_backend import make_backend, OpenAIBackend
+from prompt_budget import PromptBudgeter
+from output_writer import JsonlWriter, load_completed, load_failed, repair_tail, finalize, item_key
+from sharding import shard_indices
+from request_packing import pack_by_db, merge_few_shots, unpack_answers, PackingStats
+from scheduler import schedule_by_db, description_bytes, db_switches, LocalityReport
+
+llm = OpenAIBackend("")
 
 
 def parse_option():
@@ -23,8 +34,62 @@ def parse_option():
     parser.add_argument("--output_path", type=str)
     parser.add_argument("--model", type=str, default="codes")
     parser.add_argument("--openai_api_key", type=str, default="")
+    parser.add_argument("--schema_cache_size", type=int, default=128)
+    parser.add_argument("--schema_store_path", type=str, default="")
+    parser.add_argument("--schema_context_path", type=str, default="")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--tpm", type=int, default=0)
+    parser.add_argument("--max_attempts", type=int, default=8)
+    parser.add_argument("--max_retry_seconds", type=float, default=600.)
+    parser.add_argument("--response_cache_path", type=str, default="")
+    parser.add_argument("--response_cache_max_mb", type=int, default=1024)
+    parser.add_argument("--response_cache_readonly", action="store_true")
+    parser.add_argument("--llm_backend", type=str, default="openai", choices=["openai", "openai_compatible", "mock"])
+    parser.add_argument("--llm_base_url", type=str, default="")
+    parser.add_argument("--mock_latency", type=float, default=0.)
+    parser.add_argument("--mock_error_rate", type=float, default=0.)
+    parser.add_argument("--reserved_output_tokens", type=int, default=4096)
+    parser.add_argument("--execution", type=str, default="sync", choices=["sync", "batch"])
+    parser.add_argument("--batch_backend", type=str, default="openai", choices=["openai", "local"])
+    parser.add_argument("--batch_dir", type=str, default="")
+    parser.add_argument("--batch_poll_interval", type=float, default=60.)
+    parser.add_argument("--batch_max_resubmits", type=int, default=2)
+    parser.add_argument("--stream_path", type=str, default="")
+    parser.add_argument("--fsync_every", type=int, default=20)
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--num_shards", type=int, default=1)
+    parser.add_argument("--shard_index", type=int, default=0)
+    parser.add_argument("--retrieval_batch_size", type=int, default=256)
+    parser.add_argument("--retrieval_block_size", type=int, default=1024)
+    parser.add_argument("--embedding_index_dir", type=str, default="")
+    parser.add_argument("--embedding_task", type=str, default="")
+    parser.add_argument("--build_embedding_index", action="store_true")
+    parser.add_argument("--ann_index", type=str, default="exact", choices=["exact", "ivf", "hnsw"])
+    parser.add_argument("--ann_nlist", type=int, default=0)
+    parser.add_argument("--ann_nprobe", type=int, default=8)
+    parser.add_argument("--hnsw_m", type=int, default=16)
+    parser.add_argument("--hnsw_ef_construction", type=int, default=200)
+    parser.add_argument("--hnsw_ef_search", type=int, default=64)
+    parser.add_argument("--ann_report", action="store_true")
+    parser.add_argument("--retrieval", type=str, default="dense", choices=["dense", "hybrid", "lexical"])
+    parser.add_argument("--lexical_index_dir", type=str, default="")
+    parser.add_argument("--bm25_include_evidence", action="store_true")
+    parser.add_argument("--fusion", type=str, default="rrf", choices=["rrf", "weighted"])
+    parser.add_argument("--fusion_alpha", type=float, default=0.5)
+    parser.add_argument("--retrieval_server", type=str, default="")
+    parser.add_argument("--pack_size", type=int, default=1)
+    parser.add_argument("--pack_few_shots", type=int, default=0)
+    parser.add_argument("--schedule", type=str, default="file", choices=["file", "db_locality"])
+    parser.add_argument("--semantic_cache_threshold", type=float, default=0.)
+    parser.add_argument("--semantic_cache_gold", action="store_true")
+    parser.add_argument("--semantic_cache_path", type=str, default="")
+    parser.add_argument("--semantic_cache_sample_rate", type=float, default=0.05)
+    parser.add_argument("--semantic_cache_samples_path", type=str, default="")
 
     opt = parser.parse_args()
+    if opt.build_embedding_index and not opt.embedding_index_dir:
+        parser.error("--build_embedding_index needs --embedding_index_dir to save the index to")
 
     return opt
 
@@ -61,14 +126,44 @@ Describe in detail the reasoning of each step.
     return system_prompt, user_prompt
 
 
-def generate_reply(input, gpt_model):
-    completions = openai.ChatCompletion.create(
-        model=gpt_model,
-        messages=input,
-        temperature=0.
-    )
+def make_packed_prompt(questions, concat_schema):
+    system_prompt, _ = make_prompt("", concat_schema)
+    # the single prompt's Step 4 asks for one object, the packed answer is one array
+    system_prompt = system_prompt.replace('# Step 4. Print answer: Print your answers in json format of "reasoning" and "evidence".',
+                                          '# Step 4. Print answer: Print your answers as one json array with an object of "index", "reasoning" and "evidence" for every question.')
+    question_lines = ",\n".join(f'    {{"index": {n}, "question": "{question}", "evidence": }}' for n, question in enumerate(questions, 1))
+
+    user_prompt = f"""### problem ####################################################
+1. schema of question
+{{
+    {concat_schema}}}
     
-    return completions.choices[0].message.content
+2. questions
+[
+{question_lines}
+]
+
+### Create an evidence for every question above, each on its own.
+### Print your answers as one json array with an object per question: [{{"index": question index, "reasoning": "...", "evidence": "..."}}, ...]
+### Let's think step by step.
+
+"""
+    return system_prompt, user_prompt
+
+
+def generate_reply(input, gpt_model):
+    response = shared_cache.get(gpt_model, 0., input)
+    if response is not None:
+        return response
+
+    estimated_tokens = estimate_tokens(input, gpt_model)
+    shared_limiter.acquire(estimated_tokens)
+    result = llm.chat(input, gpt_model, temperature=0.)
+    shared_limiter.reconcile(estimated_tokens, result.usage["total_tokens"])
+
+    response = result.content
+    shared_cache.put(gpt_model, 0., input, response)
+    return response
 
 
 def generate_schema(db_path):
@@ -94,38 +189,28 @@ def read_schema_description(csv_path, db_path, num_of_sampling=30):
         table_name = os.path.splitext(csv_file)[0]  
 
         try:
-            with open(file_path, 'rb') as f:
-                raw_data = f.read()
-                encoding = detect(raw_data)['encoding']
-            with open(file_path, 'r', encoding=encoding, errors='ignore') as f:
+            text, encoding = read_text(file_path, errors='ignore')
+            with io.StringIO(text, newline=None) as f:
                 lines = [line.replace('\x00', '').replace('\n', ' ').replace('\r', ' ').strip() for line in f if line.strip()]
 
                 csv_reader = csv.reader(lines)
                 headers = next(csv_reader)
+                rows = [row for row in csv_reader if row]
+
+            column_values = sample_table_values(cursor, table_name, [row[0].strip() for row in rows], num_of_sampling)
 
-                for row in csv_reader:
-                    if row:
-                        row_description = ", ".join([f"{header}: {value}" for header, value in zip(headers, row)])
-                        row_description = "   ### " + row_description
-                        schema_description += row_description
-
-                        try:
-                            sql = f"select lower(type) from pragma_table_info('{table_name}') where name='{row[0].strip()}';"
-                            cursor.execute(sql)
-                            column_values = cursor.fetchall()
-                            if "blob" in column_values:
-                                schema_description += '\n'
-                            else:
-                                # sql = f"SELECT distinct `{row[0].strip()}` FROM `{table_name}` limit {num_of_sampling};"
-                                sql = f"SELECT distinct substr(`{row[0].strip()}`,1,100) FROM (SELECT `{row[0].strip()}` FROM `{table_name}` limit 1000) limit {num_of_sampling};"
-                                cursor.execute(sql)
-                                column_values = cursor.fetchall()
-                                column_value = ""
-                                for value in column_values:
-                                    column_value += (str(value[0]).replace('\n', ' ') + ", ")
-                                schema_description = schema_description + "   ### column value examples: " + column_value + '\n'
-                        except Exception as e:
-                            schema_description += '\n'
+            for row in rows:
+                row_description = ", ".join([f"{header}: {value}" for header, value in zip(headers, row)])
+                row_description = "   ### " + row_description
+                schema_description += row_description
+
+                if row[0].strip() in column_values:
+                    column_value = ""
+                    for value in column_values[row[0].strip()]:
+                        column_value += (str(value).replace('\n', ' ') + ", ")
+                    schema_description = schema_description + "   ### column value examples: " + column_value + '\n'
+                else:
+                    schema_description += '\n'
 
         except Exception as e:
             print(f"Warning) Error reading {csv_file}: {e}")
@@ -134,25 +219,109 @@ def read_schema_description(csv_path, db_path, num_of_sampling=30):
     return schema_description
 
 
+embedding_models = {}
+
+
+def load_embedding_model(embedding_model_name):
+    # kept per process so a long-lived caller (retrieval_server.py) reuses the model when the finder is rebuilt
+    if embedding_model_name not in embedding_models:
+        from sentence_transformers import SentenceTransformer
+        embedding_models[embedding_model_name] = SentenceTransformer(embedding_model_name, trust_remote_code=True, cache_folder="/home/janghyeon/data/cache")
+    return embedding_models[embedding_model_name]
+
+
+def filter_train_data(train_json_all):
+    # the retrieval corpus; the index files are keyed by its hash, so every tool building one must use this
+    return [item for item in train_json_all if item["evidence"].lower() not in ["", "false;"] \
+        and item["db_id"].lower() not in ["book_publishing_company", "books","hockey","movie_3","movie_4","public_review_platform","soccer_2016","works_cycles"]] # too long db
+
+
 class SimilarQuestionFinder:
-    def __init__(self, train_json_all, model):
+    def __init__(self, train_json_all, model, index_dir="", task="", ann_index="exact", ann_options=None,
+                 retrieval="dense", lexical_index_dir="", include_evidence=False, fusion="rrf", fusion_alpha=0.5):
         embedding_model_name = model
-        self.train_data = [item for item in train_json_all if item["evidence"].lower() not in ["", "false;"] \
-            and item["db_id"].lower() not in ["book_publishing_company", "books","hockey","movie_3","movie_4","public_review_platform","soccer_2016","works_cycles"]] # too long db
+        self.train_data = filter_train_data(train_json_all)
         self.questions = [item["question"] for item in self.train_data]
         self.db_ids = [item["db_id"] for item in self.train_data]
         self.evidences = [item["evidence"] for item in self.train_data]
-        self.model = SentenceTransformer(embedding_model_name, trust_remote_code=True, cache_folder="/home/janghyeon/data/cache")
-        self.embeddings = self.model.encode(self.questions, convert_to_tensor=True)
+        self.retrieval = retrieval
+        self.fusion = fusion
+        self.fusion_alpha = fusion_alpha
+        self.lexical = None
+        if retrieval != "dense":
+            from lexical_index import load_or_build as load_or_build_lexical
+            self.lexical = load_or_build_lexical(lexical_index_dir, self.questions, self.db_ids, self.evidences, include_evidence)
+        if retrieval == "lexical":
+            # BM25 only: no embedding model is loaded
+            return
+        import torch
+        from embedding_index import load_or_build
+        from ann_index import make_index
+
+        self.model = load_embedding_model(embedding_model_name)
+        self.encode_kwargs = {"task": task} if task else {}
+        if index_dir:
+            self.embeddings = torch.from_numpy(load_or_build(index_dir, embedding_model_name, task, self.questions, self.db_ids, self.evidences,
+                                                             lambda questions: self.model.encode(questions, normalize_embeddings=True, **self.encode_kwargs))).to(self.model.device)
+        else:
+            self.embeddings = self.model.encode(self.questions, convert_to_tensor=True, **self.encode_kwargs)
+        self.normalized_embeddings = torch.nn.functional.normalize(self.embeddings, p=2, dim=1)
+        # "exact" keeps the torch matmul below (runs on the model's device); ivf/hnsw search a NumPy/hnswlib index instead
+        self.index = make_index(ann_index, self.normalized_embeddings.cpu().numpy(), **(ann_options or {})) if ann_index != "exact" else None
         
     def find_similar_questions(self, target_question, top_k=5):
-        target_embedding = self.model.encode([target_question], convert_to_tensor=True)
+        if self.retrieval != "dense":
+            return self.find_similar_questions_batch([target_question], top_k)[0]
+        import torch
+        target_embedding = self.model.encode([target_question], convert_to_tensor=True, **self.encode_kwargs)
         similarities = self.model.similarity_pairwise(target_embedding, self.embeddings).squeeze(0)
         top_k_indices = torch.topk(similarities, k=top_k, largest=True).indices
         top_k_questions = [(self.questions[idx], self.db_ids[idx], self.evidences[idx]) for idx in top_k_indices]
         
         return top_k_questions
 
+    def dense_search(self, block, k, batch_size=256):
+        import torch
+        if self.index is not None:
+            target_embeddings = self.model.encode(block, batch_size=batch_size, normalize_embeddings=True, **self.encode_kwargs)
+            scores, indices = self.index.search(target_embeddings, k)
+            return scores.tolist(), indices.tolist()
+        target_embeddings = self.model.encode(block, batch_size=batch_size, convert_to_tensor=True, normalize_embeddings=True, **self.encode_kwargs)
+        similarities = target_embeddings @ self.normalized_embeddings.T
+        top_k = torch.topk(similarities, k=k, dim=1, largest=True)
+        return top_k.values.tolist(), top_k.indices.tolist()
+
+    def iter_similar_questions(self, target_questions, top_k=5, batch_size=256, block_size=1024):
+        # encodes the targets block by block and scores each block against the whole train set with one matmul,
+        # so memory stays at block_size x len(train) no matter how many targets there are
+        from lexical_index import fuse
+        top_k = min(top_k, len(self.questions))
+        candidates = top_k if self.retrieval == "dense" else min(len(self.questions), max(50, top_k * 10))
+        for start in range(0, len(target_questions), block_size):
+            block = target_questions[start:start + block_size]
+            if self.retrieval == "lexical":
+                top_k_indices = [self.lexical.search(question, top_k)[1] for question in block]
+            elif self.retrieval == "hybrid":
+                top_k_indices = []
+                for question, scores, indices in zip(block, *self.dense_search(block, candidates, batch_size)):
+                    lexical_scores, lexical_indices = self.lexical.search(question, candidates)
+                    top_k_indices.append(fuse(list(zip(indices, scores)), list(zip(lexical_indices, lexical_scores)), top_k, self.fusion, self.fusion_alpha))
+            else:
+                top_k_indices = self.dense_search(block, top_k, batch_size)[1]
+            for indices in top_k_indices:
+                yield [(self.questions[idx], self.db_ids[idx], self.evidences[idx]) for idx in indices if idx >= 0]
+
+    def find_similar_questions_batch(self, target_questions, top_k=5, batch_size=256, block_size=1024):
+        return list(self.iter_similar_questions(target_questions, top_k, batch_size, block_size))
+
+    def encode_questions(self, target_questions, batch_size=256):
+        return self.model.encode(target_questions, batch_size=batch_size, normalize_embeddings=True, **self.encode_kwargs)
+
+    def ann_recall_report(self, target_questions, top_k=5, batch_size=256):
+        from ann_index import make_index, recall_report
+        target_embeddings = self.model.encode(target_questions, batch_size=batch_size, normalize_embeddings=True, **self.encode_kwargs)
+        return recall_report(self.index or make_index("exact", self.normalized_embeddings.cpu().numpy()), self.normalized_embeddings.cpu().numpy(), target_embeddings, top_k)
+
 def extract_evidence(response_content):
     try:
         response_json = json.loads(response_content)
@@ -207,49 +376,37 @@ def concat_schema_and_desc(schema, schema_description):
         print(f"Warning) Error schema concat : {e}")
         return schema
 
-if __name__ == "__main__":
-    opt = parse_option()
-    print(opt)
 
-    ###settting#####################################################################################
-    openai.api_key = opt.openai_api_key
-    gpt_model="gpt-4o" # gpt-4o-mini, gpt-4o, o1-preview, o1-mini
-    embedding_model_name = "sentence-transformers/all-mpnet-base-v2" # "Lajavaness/bilingual-embedding-large", "jinaai/jina-embeddings-v3"
-    ################################################################################################
+def build_schema_context(db_root, db_id, num_of_sampling):
+    schema = generate_schema(f"{db_root}/{db_id}/{db_id}.sqlite")
+    schema_description = read_schema_description(f"{db_root}/{db_id}/database_description", f"{db_root}/{db_id}/{db_id}.sqlite", num_of_sampling)
+    return concat_schema_and_desc(schema, schema_description)
 
-    res = []
-    with open(opt.dataset_json_path, 'rb') as f:
-        raw_data = f.read()
-        encoding = detect(raw_data)['encoding']
-    with open(opt.dataset_json_path, encoding=encoding) as f:
-        question_json_all = json.load(f)
-    with open(opt.train_json_path, encoding=encoding) as f:
-        train_json_all = json.load(f)
 
-    print("### make evidence start  ###")
-    finder = SimilarQuestionFinder(train_json_all, embedding_model_name)
+def build_prompt(data, finder, schema_cache, opt, similar_questions=None):
+    concat_schema = schema_cache.get(opt.db_path, data['db_id'], 30)
 
-    for i, data in enumerate(tqdm(question_json_all)):
-        schema = generate_schema(f"{opt.db_path}/{data['db_id']}/{data['db_id']}.sqlite")
-        schema_description = read_schema_description(f"{opt.db_path}/{data['db_id']}/database_description", f"{opt.db_path}/{data['db_id']}/{data['db_id']}.sqlite", 30)
+    system_prompt, user_prompt = make_prompt(data["question"], concat_schema)
 
-        concat_schema = concat_schema_and_desc(schema, schema_description)
+    prompt = [{"role": "system", "content": system_prompt}]
 
-        system_prompt, user_prompt = make_prompt(data["question"], concat_schema)
+    if similar_questions is None:
+        similar_questions = finder.find_similar_questions(data['question'], opt.top_n)
+    prompt += few_shot_messages(similar_questions, schema_cache, opt)
+    prompt.append({"role": "user", "content": user_prompt})
 
-        prompt = [{"role": "system", "content": system_prompt}]
+    return prompt
 
-        similar_questions = finder.find_similar_questions(data['question'], opt.top_n)
-        sample_num = 0
-        for question, db_id, evidence in similar_questions:
-            train_schema = generate_schema(f"{opt.train_db_path}/{db_id}/{db_id}.sqlite")
-            train_schema_description = read_schema_description(f"{opt.train_db_path}/{db_id}/database_description", f"{opt.train_db_path}/{db_id}/{db_id}.sqlite", 5)
 
-            concat_train_schema = concat_schema_and_desc(train_schema, train_schema_description)
+def few_shot_messages(similar_questions, schema_cache, opt):
+    messages = []
+    sample_num = 0
+    for question, db_id, evidence in similar_questions:
+        concat_train_schema = schema_cache.get(opt.train_db_path, db_id, 5)
 
-            sample_num += 1
-            # train_sample_assistant = evidence
-            train_sample_user = f"""
+        sample_num += 1
+        # train_sample_assistant = evidence
+        train_sample_user = f"""
 ### few-shot sample {sample_num} ####################################################
 1. DB Schema of Samples
 {{
@@ -263,34 +420,231 @@ if __name__ == "__main__":
 }}
 ##################################################################
 """
-            prompt.append({"role": "user", "content": train_sample_user})
-            # prompt.append({"role": "assistant", "content": train_sample_assistant})
-            
-        prompt.append({"role": "user", "content": user_prompt})
+        messages.append({"role": "user", "content": train_sample_user})
+        # messages.append({"role": "assistant", "content": train_sample_assistant})
+
+    return messages
+
+
+def build_packed_prompt(group, schema_cache, opt, similar):
+    # one schema and one system prompt for up to pack_size questions of the same database
+    concat_schema = schema_cache.get(opt.db_path, group[0][1]['db_id'], 30)
+    system_prompt, user_prompt = make_packed_prompt([data["question"] for _, data in group], concat_schema)
+
+    prompt = [{"role": "system", "content": system_prompt}]
+    prompt += few_shot_messages(merge_few_shots([similar[i] for i, _ in group], opt.pack_few_shots or opt.top_n), schema_cache, opt)
+    prompt.append({"role": "user", "content": user_prompt})
+
+    return prompt
+
+
+def request_reply(prompt, gpt_model, deadline=None):
+    def drop_few_shot():
+        if len(prompt) > 2:
+            prompt.pop(-2)  # Remove the lowest-ranked few-shot sample (message before the problem)
+            return True
+        return False
+
+    try:
+        return shared_policy.call(lambda: generate_reply(prompt, gpt_model), on_context_overflow=drop_few_shot, deadline=deadline)
+    except RetryExhausted as e:
+        print(f"Warning) {e}")
+        return None
+
+
+def request_packed(group, prompt, build_single, gpt_model, packing_stats):
+    # questions the packed answer does not cover (or that fail to parse) are retried one by one
+    unpacked = {}
+    if len(group) > 1:
+        unpacked = unpack_answers(request_reply(prompt, gpt_model), len(group))
+        packing_stats.record(len(group), len(unpacked))
+
+    results = []
+    for n, item in enumerate(group):
+        if n in unpacked:
+            results.append((prompt, unpacked[n]))
+        else:
+            single_prompt = build_single(item)
+            results.append((single_prompt, request_reply(single_prompt, gpt_model)))
+    return results
 
+
+if __name__ == "__main__":
+    opt = parse_option()
+    print(opt)
+
+    ###settting#####################################################################################
+    llm = make_backend(opt.llm_backend, opt.openai_api_key, opt.llm_base_url, opt.mock_latency, opt.mock_error_rate)
+    shared_limiter.configure(opt.rpm, opt.tpm)
+    shared_policy.configure(opt.max_attempts, opt.max_retry_seconds)
+    if opt.response_cache_path:
+        shared_cache.open(opt.response_cache_path, opt.response_cache_max_mb * 1024 * 1024, opt.response_cache_readonly)
+    gpt_model="gpt-4o" # gpt-4o-mini, gpt-4o, o1-preview, o1-mini
+    embedding_model_name = "sentence-transformers/all-mpnet-base-v2" # "Lajavaness/bilingual-embedding-large", "jinaai/jina-embeddings-v3"
+    ################################################################################################
+
+    text, encoding = read_text(opt.dataset_json_path)
+    question_json_all = json.loads(text)
+    text, _ = read_text(opt.train_json_path)
+    train_json_all = json.loads(text)
+
+    print("### make evidence start  ###")
+    ann_options = {"nlist": opt.ann_nlist, "nprobe": opt.ann_nprobe, "hnsw_m": opt.hnsw_m, "hnsw_ef_construction": opt.hnsw_ef_construction, "hnsw_ef_search": opt.hnsw_ef_search}
+    if opt.retrieval_server:
+        from retrieval_server import RetrievalClient
+        finder = RetrievalClient(opt.retrieval_server)
+        print(f"### retrieval server: {finder.health()}")
+    else:
+        finder = SimilarQuestionFinder(train_json_all, embedding_model_name, opt.embedding_index_dir, opt.embedding_task, opt.ann_index, ann_options,
+                                       opt.retrieval, opt.lexical_index_dir, opt.bm25_include_evidence, opt.fusion, opt.fusion_alpha)
+    if opt.build_embedding_index:
+        sys.exit(0)
+    schema_store = SchemaStore(opt.schema_store_path) if opt.schema_store_path else None
+    schema_cache = SchemaContextCache(build_schema_context, opt.schema_cache_size, store=schema_store, variant="make_evidence")
+    if opt.schema_context_path:
+        schema_cache.preload(load_schema_contexts(opt.schema_context_path, schema_cache.variant))
+
+    budgeter = PromptBudgeter(gpt_model, opt.reserved_output_tokens)
+
+    stream_path = opt.stream_path or opt.output_path + ".jsonl"
+    completed = {}
+    if opt.resume:
+        repair_tail(stream_path)
+        completed = load_completed(stream_path)
+        print(f"### resume: {len(completed)} items already done ###")
+    shard = shard_indices(question_json_all, opt.num_shards, opt.shard_index) if opt.num_shards > 1 else None
+    todo = [(i, data) for i, data in enumerate(question_json_all) if item_key(i, data) not in completed and (shard is None or i in shard)]
+    if opt.schedule == "db_locality":
+        scheduled = schedule_by_db(todo, opt.concurrency, lambda db_id: description_bytes(opt.db_path, db_id))
+        print(f"### schedule: db switches per worker {db_switches(todo, opt.concurrency)} -> {db_switches(scheduled, opt.concurrency)} ###")
+        todo = scheduled
+    locality = LocalityReport()
+    similar = dict(zip([i for i, _ in todo], finder.iter_similar_questions([data["question"] for _, data in todo], opt.top_n, opt.retrieval_batch_size, opt.retrieval_block_size)))
+    if opt.ann_report and opt.retrieval != "lexical" and not opt.retrieval_server:
+        print(f"### ann recall: {finder.ann_recall_report([data['question'] for _, data in todo], opt.top_n)}")
+    semantic = None
+    if opt.semantic_cache_threshold > 0:
+        if opt.retrieval_server or opt.retrieval == "lexical":
+            print("Warning) --semantic_cache_threshold needs the local embedding model, it is ignored with --retrieval_server or --retrieval lexical")
+        else:
+            from semantic_cache import SemanticEvidenceCache
+            semantic = SemanticEvidenceCache(opt.semantic_cache_threshold, opt.semantic_cache_sample_rate)
+            if opt.semantic_cache_gold:
+                semantic.add_many(finder.db_ids, finder.questions, finder.normalized_embeddings.cpu().numpy(), finder.evidences, "gold")
+            if opt.semantic_cache_path:
+                print(f"### semantic cache: loaded {semantic.open(opt.semantic_cache_path, finder.encode_questions)} generated evidences ###")
+            query_embeddings = dict(zip([i for i, _ in todo], finder.encode_questions([data["question"] for _, data in todo], opt.retrieval_batch_size)))
+    packing_stats = PackingStats()
+    if opt.pack_size > 1 and opt.execution == "batch":
+        print("Warning) --pack_size is only used with --execution sync")
+    writer = JsonlWriter(stream_path, resume=opt.resume, fsync_every=opt.fsync_every)
+    from tqdm import tqdm
+    pbar = tqdm(total=len(todo))
+
+    def write_result(_, item, prompt, response, reused=False):
+        i, data = item
         print(prompt)
 
-        response = None
-        while response is None:
-            try:
-                response = generate_reply(prompt, gpt_model)
-            except Exception as e:
-                print('api error, wait for 3 seconds and retry...')
-                print(e)
-                time.sleep(3)
-                if str(e).startswith("This model's maximum context length is") and len(prompt) > 2:
-                    prompt.pop(1)  # Remove the second message (user message after system prompt)
-                    # prompt.pop(1)  # Remove the third message (assistant response)
-                pass
-
-        data["evidence"] = str(extract_evidence(response)).replace('\n',', ')
+        if response is None:
+            data["evidence"] = "Warning) No response from API"
+        else:
+            data["evidence"] = str(extract_evidence(response)).replace('\n',', ')
+            if semantic is not None and not reused and not data["evidence"].startswith("Warning)"):
+                semantic.add(data["db_id"], data["question"], query_embeddings[i], data["evidence"])
 
         print(response)
         print(data["evidence"])
 
         if opt.model == "codes":
             data["text"] = data["evidence"] + " " + data["question"]
-        res.append(data)
-        
-    with open(opt.output_path, 'w', encoding=encoding) as f:
-        json.dump(res, f, indent=2)
+        writer.write(i, data, ok=response is not None)
+        locality.finish(data["db_id"])
+        pbar.update(1)
+
+    def build_single(item):
+        locality.start(item[1]["db_id"])
+        return budgeter.fit(build_prompt(item[1], finder, schema_cache, opt, similar[item[0]]))
+
+    def reuse_evidence(item):
+        # -> a single-question style response taken from the semantic cache, or None when the LLM has to answer
+        if semantic is None:
+            return None
+        hit = semantic.lookup(item[1]["db_id"], item[1]["question"], query_embeddings[item[0]])
+        if hit is None:
+            return None
+        evidence, matched_question, score, source = hit
+        return json.dumps({"reasoning": f"reused the {source} evidence of \"{matched_question}\" (similarity {score:.3f})", "evidence": evidence}, ensure_ascii=False)
+
+    def build_group(group):
+        locality.start(group[0][1]["db_id"])
+        return group, budgeter.fit(build_packed_prompt(group, schema_cache, opt, similar))
+
+    try:
+        if semantic is not None and (opt.execution == "batch" or opt.pack_size > 1):
+            # these modes build every request before any answer arrives, so only evidence known up front is reused
+            remaining = []
+            for item in todo:
+                response = reuse_evidence(item)
+                if response is None:
+                    remaining.append(item)
+                else:
+                    write_result(0, item, None, response, reused=True)
+            todo = remaining
+        if opt.execution == "batch":
+            from batch_runner import run_batch, OpenAIBatchBackend, LocalBatchBackend
+            prompts = {i: build_single((i, data)) for i, data in todo}
+            responses = {i: shared_cache.get(gpt_model, 0., prompt) for i, prompt in prompts.items()}
+            if opt.batch_backend == "local":
+                backend = LocalBatchBackend(os.path.join(opt.batch_dir or opt.output_path + ".batch", "local_api"))
+            else:
+                backend = OpenAIBatchBackend(opt.openai_api_key)
+            pending = [(i, prompt) for i, prompt in prompts.items() if responses[i] is None]
+            for i, response in run_batch(pending, gpt_model, backend, opt.batch_dir or opt.output_path + ".batch", opt.batch_poll_interval,
+                                         opt.batch_max_resubmits):
+                if i not in prompts:
+                    continue
+                responses[i] = response
+                if response is not None:
+                    shared_cache.put(gpt_model, 0., prompts[i], response)
+            for n, (i, data) in enumerate(todo):
+                write_result(n, (i, data), prompts[i], responses[i])
+        elif opt.pack_size > 1:
+            from llm_engine import run_ordered
+
+            def write_group(_, group, request, results):
+                for item, (prompt, response) in zip(group, results):
+                    write_result(0, item, prompt, response)
+
+            run_ordered(pack_by_db(todo, opt.pack_size),
+                        build_group,
+                        lambda request: request_packed(request[0], request[1], build_single, gpt_model, packing_stats),
+                        write_group,
+                        concurrency=opt.concurrency)
+        else:
+            from llm_engine import run_ordered
+            # a semantic cache hit is built as its response string and skips the request
+            run_ordered(todo,
+                        lambda item: reuse_evidence(item) or build_single(item),
+                        lambda request: request if isinstance(request, str) else request_reply(request, gpt_model),
+                        lambda n, item, request, response: write_result(n, item, request, response, reused=isinstance(request, str)),
+                        concurrency=opt.concurrency)
+    finally:
+        pbar.close()
+        writer.close()
+
+    print(f"### schema cache: {schema_cache.stats()}")
+    print(f"### rate limiter: {shared_limiter.stats()}")
+    print(f"### retry policy: {shared_policy.stats()}")
+    print(f"### response cache: {shared_cache.stats()}")
+    print(f"### prompt budget: {budgeter.stats()}")
+    if opt.pack_size > 1:
+        print(f"### request packing: {packing_stats.stats()}")
+    if semantic is not None:
+        samples_path = opt.semantic_cache_samples_path or opt.output_path + ".semantic_samples.jsonl"
+        print(f"### semantic cache: {semantic.stats()}")
+        print(f"### semantic cache: wrote {semantic.write_samples(samples_path)} quality-check samples to {samples_path} ###")
+    print(f"### per-database wall time: {locality.stats()}")
+    print(f"### wrote {finalize(stream_path, opt.output_path, encoding)} items to {opt.output_path} ###")
+    failed = load_failed(stream_path)
+    if failed:
+        print(f"Warning) {len(failed)} items got no response (keys {', '.join(record['key'] for record in failed[:20])}{', ...' if len(failed) > 20 else ''}); rerun with --resume to retry them")
@@ -1,8 +1,6 @@
 import json
 import argparse
-import openai
 import time
-from tqdm import tqdm
 from collections import Counter
 import sqlite3
 import glob
@@ -10,7 +8,7 @@ import os
 import csv
 import io
 
-openai.api_key = ""
+openai_api_key = ""
 
 def parse_option():
     parser = argparse.ArgumentParser("command line arguments")
@@ -276,6 +274,8 @@ action
 
 
 def generate_reply(input):
+    import openai
+    openai.api_key = openai_api_key
     completions = openai.ChatCompletion.create(
         model="gpt-3.5-turbo",
         messages=input,
@@ -321,6 +321,7 @@ def read_schema_description(db_path):
 
 if __name__ == "__main__":
     opt = parse_option()
+    from tqdm import tqdm
     print(opt)
     with open(opt.dataset_json_path, encoding='utf-8') as f:
         question_json_all = json.load(f)
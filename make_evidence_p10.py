@@ -1,8 +1,6 @@
 import json
 import argparse
-import openai
 import time
-from tqdm import tqdm
 from collections import Counter
 import sqlite3
 import glob
@@ -10,7 +8,7 @@ import os
 import csv
 import io
 
-openai.api_key = ""
+openai_api_key = ""
 
 def parse_option():
     parser = argparse.ArgumentParser("command line arguments")
@@ -164,6 +162,8 @@ Let's think step by step and generate evidence.
 
 
 def generate_reply(input):
+    import openai
+    openai.api_key = openai_api_key
     completions = openai.ChatCompletion.create(
         # model="gpt-3.5-turbo",
         model="gpt-4o-mini",
@@ -217,6 +217,7 @@ def read_schema_description(db_path):
 
 if __name__ == "__main__":
     opt = parse_option()
+    from tqdm import tqdm
     print(opt)
     with open(opt.dataset_json_path, encoding='utf-8') as f:
         question_json_all = json.load(f)
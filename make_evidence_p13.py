@@ -1,18 +1,14 @@
 import json
 import argparse
-import openai
 import time
-from tqdm import tqdm
 from collections import Counter
 import sqlite3
 import glob
 import os
 import csv
 import io
-from sentence_transformers import SentenceTransformer
-import torch
 
-openai.api_key = ""
+openai_api_key = ""
 
 def parse_option():
     parser = argparse.ArgumentParser("command line arguments")
@@ -62,6 +58,8 @@ Let's think step by step and generate evidence.
 
 
 def generate_reply(input):
+    import openai
+    openai.api_key = openai_api_key
     completions = openai.ChatCompletion.create(
         # model="gpt-3.5-turbo",
         model="gpt-4o-mini",
@@ -128,6 +126,7 @@ def read_schema_description(csv_path, db_path):
 
 class SimilarQuestionFinder:
     def __init__(self, train_json_path, model_name="sentence-transformers/all-mpnet-base-v2"):
+        from sentence_transformers import SentenceTransformer
         with open(train_json_path, 'r') as f:
             self.train_data = json.load(f)
         
@@ -138,6 +137,7 @@ class SimilarQuestionFinder:
         self.embeddings = self.model.encode(self.questions, convert_to_tensor=True)
         
     def find_similar_questions(self, target_question, top_k=5):
+        import torch
         target_embedding = self.model.encode([target_question], convert_to_tensor=True)
         distances = torch.cdist(target_embedding, self.embeddings).squeeze(0)
         top_k_indices = torch.topk(distances, k=top_k, largest=False).indices
@@ -148,6 +148,7 @@ class SimilarQuestionFinder:
 
 if __name__ == "__main__":
     opt = parse_option()
+    from tqdm import tqdm
     print(opt)
     with open(opt.dataset_json_path, encoding='utf-8') as f:
         question_json_all = json.load(f)
@@ -1,17 +1,13 @@
 import json
 import argparse
-import openai
-from tqdm import tqdm
 import sqlite3
 import os
 import time
 import csv
-from sentence_transformers import SentenceTransformer
-import torch
 import re
 import jellyfish
 
-openai.api_key = ""
+openai_api_key = ""
 
 def parse_option():
     parser = argparse.ArgumentParser("command line arguments")
@@ -61,6 +57,8 @@ Your objective is to generate evidence by understanding the given question, data
 
 
 def generate_reply(input):
+    import openai
+    openai.api_key = openai_api_key
     completions = openai.ChatCompletion.create(
         model="gpt-4o-mini",
         messages=input,
@@ -126,6 +124,7 @@ def read_schema_description(csv_path, db_path, num_of_sampling=10):
 
 class SimilarQuestionFinder:
     def __init__(self, train_json_all, model_name):
+        from sentence_transformers import SentenceTransformer
         self.train_data = [item for item in train_json_all if item["evidence"].lower() not in ["", "false;"]]
         self.questions = [item["question"] for item in self.train_data]
         self.masked_questions = [item["masked_question"] for item in self.train_data]
@@ -135,6 +134,7 @@ class SimilarQuestionFinder:
         self.embeddings = self.model.encode(self.masked_questions, convert_to_tensor=True)
         
     def find_similar_questions(self, target_question, top_k=5):
+        import torch
         target_embedding = self.model.encode([target_question], convert_to_tensor=True)
         distances = torch.cdist(target_embedding, self.embeddings).squeeze(0)
         top_k_indices = torch.topk(distances, k=top_k, largest=False).indices
@@ -242,6 +242,7 @@ def question_masking(json_data, table_json):
 
 if __name__ == "__main__":
     opt = parse_option()
+    from tqdm import tqdm
     print(opt)
     res = []
 
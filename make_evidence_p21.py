@@ -1,16 +1,12 @@
 import json
 import argparse
-import openai
-from tqdm import tqdm
 import sqlite3
 import os
 import time
 import csv
-from sentence_transformers import SentenceTransformer
-import torch
 import re
 
-openai.api_key = ""
+openai_api_key = ""
 
 def parse_option():
     parser = argparse.ArgumentParser("command line arguments")
@@ -58,6 +54,8 @@ Your objective is to generate evidence by understanding the given question, data
 
 
 def generate_reply(input):
+    import openai
+    openai.api_key = openai_api_key
     completions = openai.ChatCompletion.create(
         model="gpt-4o-mini",
         messages=input,
@@ -123,6 +121,7 @@ def read_schema_description(csv_path, db_path, num_of_sampling=10):
 
 class SimilarQuestionFinder:
     def __init__(self, train_json_all, model_name):
+        from sentence_transformers import SentenceTransformer
         self.train_data = [item for item in train_json_all if item["evidence"].lower() not in ["", "false;"]]
         self.questions = [item["question"] for item in self.train_data]
         self.db_ids = [item["db_id"] for item in self.train_data]
@@ -131,6 +130,7 @@ class SimilarQuestionFinder:
         self.embeddings = self.model.encode(self.questions, convert_to_tensor=True)
         
     def find_similar_questions(self, target_question, top_k=5):
+        import torch
         target_embedding = self.model.encode([target_question], convert_to_tensor=True)
         distances = torch.cdist(target_embedding, self.embeddings).squeeze(0)
         top_k_indices = torch.topk(distances, k=top_k, largest=False).indices
@@ -159,6 +159,7 @@ def extract_evidence(response_content):
 
 if __name__ == "__main__":
     opt = parse_option()
+    from tqdm import tqdm
     print(opt)
     res = []
     with open(opt.dataset_json_path, encoding='utf-8') as f:
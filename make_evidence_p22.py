@@ -1,13 +1,9 @@
 import json
 import argparse
-import openai
-from tqdm import tqdm
 import sqlite3
 import os
 import time
 import csv
-from sentence_transformers import SentenceTransformer
-import torch
 import re
 
 def parse_option():
@@ -57,6 +53,7 @@ Perform the following tasks to create an evidence that helps you create SQL.
 
 
 def generate_reply(input):
+    import openai
     completions = openai.ChatCompletion.create(
         model="gpt-4o-mini",
         messages=input,
@@ -122,6 +119,7 @@ def read_schema_description(csv_path, db_path, num_of_sampling=30):
 
 class SimilarQuestionFinder:
     def __init__(self, train_json_all, model_name):
+        from sentence_transformers import SentenceTransformer
         self.train_data = [item for item in train_json_all if item["evidence"].lower() not in ["", "false;"]]
         self.questions = [item["question"] for item in self.train_data]
         self.db_ids = [item["db_id"] for item in self.train_data]
@@ -130,6 +128,7 @@ class SimilarQuestionFinder:
         self.embeddings = self.model.encode(self.questions, convert_to_tensor=True)
         
     def find_similar_questions(self, target_question, top_k=5):
+        import torch
         target_embedding = self.model.encode([target_question], convert_to_tensor=True)
         distances = torch.cdist(target_embedding, self.embeddings).squeeze(0)
         top_k_indices = torch.topk(distances, k=top_k, largest=False).indices
@@ -158,6 +157,8 @@ def extract_evidence(response_content):
 
 if __name__ == "__main__":
     opt = parse_option()
+    import openai
+    from tqdm import tqdm
     print(opt)
 
     openai.api_key = opt.openai_api_key
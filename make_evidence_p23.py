@@ -1,13 +1,9 @@
 import json
 import argparse
-import openai
-from tqdm import tqdm
 import sqlite3
 import os
 import time
 import csv
-from sentence_transformers import SentenceTransformer
-import torch
 import re
 
 def parse_option():
@@ -57,6 +53,7 @@ Perform the following tasks to create an evidence that helps you create SQL.
 
 
 def generate_reply(input):
+    import openai
     completions = openai.ChatCompletion.create(
         model="gpt-4o-mini",
         messages=input,
@@ -141,6 +138,7 @@ class SimilarQuestionFinder:
     def __init__(self, train_json_all):
         # embedding_model_name = "sentence-transformers/all-mpnet-base-v2"
         # embedding_model_name = "Lajavaness/bilingual-embedding-large"
+        from sentence_transformers import SentenceTransformer
         embedding_model_name, self.task = "jinaai/jina-embeddings-v3", "text-matching"
         self.train_data = [item for item in train_json_all if item["evidence"].lower() not in ["", "false;"]]
         self.questions = [item["question"] for item in self.train_data]
@@ -150,6 +148,7 @@ class SimilarQuestionFinder:
         self.embeddings = self.model.encode(self.questions, convert_to_tensor=True, task=self.task)
         
     def find_similar_questions(self, target_question, top_k=5):
+        import torch
         target_embedding = self.model.encode([target_question], convert_to_tensor=True, task=self.task)
         similarities = self.model.similarity_pairwise(target_embedding, self.embeddings).squeeze(0)
         top_k_indices = torch.topk(similarities, k=top_k, largest=True).indices
@@ -177,6 +176,8 @@ def extract_evidence(response_content):
 
 if __name__ == "__main__":
     opt = parse_option()
+    import openai
+    from tqdm import tqdm
     print(opt)
 
     openai.api_key = opt.openai_api_key
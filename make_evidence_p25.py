@@ -1,13 +1,9 @@
 import json
 import argparse
-import openai
-from tqdm import tqdm
 import sqlite3
 import os
 import time
 import csv
-from sentence_transformers import SentenceTransformer
-import torch
 import re
 
 def parse_option():
@@ -57,6 +53,7 @@ Perform the following tasks to create an evidence that helps you create SQL.
 
 
 def generate_reply(input):
+    import openai
     completions = openai.ChatCompletion.create(
         model="gpt-4o-mini",
         messages=input,
@@ -122,6 +119,7 @@ def read_schema_description(csv_path, db_path, num_of_sampling=30):
 
 class SimilarQuestionFinder:
     def __init__(self, train_json_all):
+        from sentence_transformers import SentenceTransformer
         embedding_model_name, self.task = "sentence-transformers/all-mpnet-base-v2", None
         # embedding_model_name, self.task = "Lajavaness/bilingual-embedding-large", None
         # embedding_model_name, self.task = "jinaai/jina-embeddings-v3", "text-matching"
@@ -133,6 +131,7 @@ class SimilarQuestionFinder:
         self.embeddings = self.model.encode(self.questions, convert_to_tensor=True, task=self.task)
         
     def find_similar_questions(self, target_question, top_k=5):
+        import torch
         target_embedding = self.model.encode([target_question], convert_to_tensor=True, task=self.task)
         similarities = self.model.similarity_pairwise(target_embedding, self.embeddings).squeeze(0)
         top_k_indices = torch.topk(similarities, k=top_k, largest=True).indices
@@ -160,6 +159,8 @@ def extract_evidence(response_content):
 
 if __name__ == "__main__":
     opt = parse_option()
+    import openai
+    from tqdm import tqdm
     print(opt)
 
     openai.api_key = opt.openai_api_key
@@ -1,15 +1,16 @@
 import json
 import argparse
-import openai
-from tqdm import tqdm
 import sqlite3
 import os
 import time
 import csv
-from sentence_transformers import SentenceTransformer
-import torch
+import io
 import re
-from charset_normalizer import detect
+from schema_cache import SchemaContextCache
+from text_encoding import read_text
+from column_sampler import sample_table_values
+from schema_store import SchemaStore
+from prepare import load_schema_contexts
 
 def parse_option():
     parser = argparse.ArgumentParser("command line arguments")
@@ -23,6 +24,9 @@ def parse_option():
     parser.add_argument("--train_table_json_path", type=str, default="")
     parser.add_argument("--model", type=str, default="codes")
     parser.add_argument("--openai_api_key", type=str, default="")
+    parser.add_argument("--schema_cache_size", type=int, default=128)
+    parser.add_argument("--schema_store_path", type=str, default="")
+    parser.add_argument("--schema_context_path", type=str, default="")
 
     opt = parser.parse_args()
 
@@ -59,6 +63,7 @@ Describe in detail the reasoning of each step.
 
 
 def generate_reply(input):
+    import openai
     completions = openai.ChatCompletion.create(
         model="gpt-4o-mini",
         messages=input,
@@ -91,32 +96,29 @@ def read_schema_description(csv_path, db_path, num_of_sampling=30):
         table_name = os.path.splitext(csv_file)[0]  
 
         try:
-            with open(file_path, 'rb') as f:
-                raw_data = f.read()
-                encoding = detect(raw_data)['encoding']
-            with open(file_path, 'r', encoding=encoding, errors='ignore') as f:
+            text, encoding = read_text(file_path, errors='ignore')
+            with io.StringIO(text, newline=None) as f:
                 lines = [line.replace('\x00', '').replace('\n', ' ').replace('\r', ' ').strip() for line in f if line.strip()]
 
                 csv_reader = csv.reader(lines)
                 headers = next(csv_reader)
+                rows = [row for row in csv_reader if row]
 
-                for row in csv_reader:
-                    if row:
-                        row_description = ", ".join([f"{header}: {value}" for header, value in zip(headers, row)])
-                        row_description = "   ### " + row_description
-                        schema_description += row_description
-
-                        try:
-                            # sql = f"SELECT distinct `{row[0].strip()}` FROM `{table_name}` limit {num_of_sampling};"
-                            sql = f"SELECT distinct `{row[0].strip()}` FROM (SELECT `{row[0].strip()}` FROM `{table_name}` limit 1000) limit {num_of_sampling};"
-                            cursor.execute(sql)
-                            column_values = cursor.fetchall()
-                            column_value = ""
-                            for value in column_values:
-                                column_value += (str(value[0]) + ", ")
-                            schema_description = schema_description + "   ### column value examples: " + column_value + '\n'
-                        except Exception as e:
-                            schema_description += '\n'
+            column_values = sample_table_values(cursor, table_name, [row[0].strip() for row in rows], num_of_sampling, max_length=None, skip_blobs=False,
+                                                per_column=True)
+
+            for row in rows:
+                row_description = ", ".join([f"{header}: {value}" for header, value in zip(headers, row)])
+                row_description = "   ### " + row_description
+                schema_description += row_description
+
+                if row[0].strip() in column_values:
+                    column_value = ""
+                    for value in column_values[row[0].strip()]:
+                        column_value += (str(value) + ", ")
+                    schema_description = schema_description + "   ### column value examples: " + column_value + '\n'
+                else:
+                    schema_description += '\n'
 
         except Exception as e:
             print(f"Error reading {csv_file}: {e}")
@@ -127,6 +129,7 @@ def read_schema_description(csv_path, db_path, num_of_sampling=30):
 
 class SimilarQuestionFinder:
     def __init__(self, train_json_all):
+        from sentence_transformers import SentenceTransformer
         embedding_model_name, self.task = "sentence-transformers/all-mpnet-base-v2", None
         # embedding_model_name, self.task = "Lajavaness/bilingual-embedding-large", None
         # embedding_model_name, self.task = "jinaai/jina-embeddings-v3", "text-matching"
@@ -138,6 +141,7 @@ class SimilarQuestionFinder:
         self.embeddings = self.model.encode(self.questions, convert_to_tensor=True, task=self.task)
         
     def find_similar_questions(self, target_question, top_k=5):
+        import torch
         target_embedding = self.model.encode([target_question], convert_to_tensor=True, task=self.task)
         similarities = self.model.similarity_pairwise(target_embedding, self.embeddings).squeeze(0)
         top_k_indices = torch.topk(similarities, k=top_k, largest=True).indices
@@ -193,8 +197,16 @@ def concat_schema_and_desc(schema, schema_description):
     concat_schema = "\n".join(concat_schema_lines)
     return concat_schema
 
+
+def build_schema_context(db_root, db_id, num_of_sampling):
+    schema = generate_schema(f"{db_root}/{db_id}/{db_id}.sqlite")
+    schema_description = read_schema_description(f"{db_root}/{db_id}/database_description", f"{db_root}/{db_id}/{db_id}.sqlite", num_of_sampling)
+    return concat_schema_and_desc(schema, schema_description)
+
 if __name__ == "__main__":
     opt = parse_option()
+    import openai
+    from tqdm import tqdm
     print(opt)
 
     openai.api_key = opt.openai_api_key
@@ -207,12 +219,13 @@ if __name__ == "__main__":
 
     print("### make evidence start  ###")
     finder = SimilarQuestionFinder(train_json_all)
+    schema_store = SchemaStore(opt.schema_store_path) if opt.schema_store_path else None
+    schema_cache = SchemaContextCache(build_schema_context, opt.schema_cache_size, store=schema_store, variant="make_evidence_p26")
+    if opt.schema_context_path:
+        schema_cache.preload(load_schema_contexts(opt.schema_context_path, schema_cache.variant))
 
     for i, data in enumerate(tqdm(question_json_all)):
-        schema = generate_schema(f"{opt.db_path}/{data['db_id']}/{data['db_id']}.sqlite")
-        schema_description = read_schema_description(f"{opt.db_path}/{data['db_id']}/database_description", f"{opt.db_path}/{data['db_id']}/{data['db_id']}.sqlite")
-
-        concat_schema = concat_schema_and_desc(schema, schema_description)
+        concat_schema = schema_cache.get(opt.db_path, data['db_id'], 30)
 
         system_prompt, user_prompt = make_prompt(data["question"], concat_schema)
 
@@ -221,10 +234,7 @@ if __name__ == "__main__":
         similar_questions = finder.find_similar_questions(data['question'], opt.top_n)
         train_sample_user, train_sample_assistant, sample_num = [], [], 0
         for question, db_id, evidence in similar_questions:
-            train_schema = generate_schema(f"{opt.train_db_path}/{db_id}/{db_id}.sqlite")
-            train_schema_description = read_schema_description(f"{opt.train_db_path}/{db_id}/database_description", f"{opt.train_db_path}/{db_id}/{db_id}.sqlite")
-
-            concat_train_schema = concat_schema_and_desc(train_schema, train_schema_description)
+            concat_train_schema = schema_cache.get(opt.train_db_path, db_id, 30)
 
             sample_num += 1
             train_sample_assistant = evidence
@@ -270,5 +280,6 @@ if __name__ == "__main__":
             data["text"] = data["evidence"] + " " + data["question"]
         res.append(data)
         
+    print(f"### schema cache: {schema_cache.stats()}")
     with open(opt.output_path, 'w', encoding='utf-8') as f:
         json.dump(res, f, indent=2)
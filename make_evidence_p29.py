@@ -1,15 +1,16 @@
 import json
 import argparse
-import openai
-from tqdm import tqdm
 import sqlite3
 import os
 import time
 import csv
-from sentence_transformers import SentenceTransformer
-import torch
+import io
 import re
-from charset_normalizer import detect
+from schema_cache import SchemaContextCache
+from text_encoding import read_text
+from column_sampler import sample_table_values
+from schema_store import SchemaStore
+from prepare import load_schema_contexts
 
 
 
@@ -23,6 +24,9 @@ def parse_option():
     parser.add_argument("--output_path", type=str)
     parser.add_argument("--model", type=str, default="codes")
     parser.add_argument("--openai_api_key", type=str, default="")
+    parser.add_argument("--schema_cache_size", type=int, default=128)
+    parser.add_argument("--schema_store_path", type=str, default="")
+    parser.add_argument("--schema_context_path", type=str, default="")
 
     opt = parser.parse_args()
 
@@ -62,6 +66,7 @@ Describe in detail the reasoning of each step.
 
 
 def generate_reply(input, gpt_model):
+    import openai
     completions = openai.ChatCompletion.create(
         model=gpt_model,
         messages=input,
@@ -94,38 +99,28 @@ def read_schema_description(csv_path, db_path, num_of_sampling=30):
         table_name = os.path.splitext(csv_file)[0]  
 
         try:
-            with open(file_path, 'rb') as f:
-                raw_data = f.read()
-                encoding = detect(raw_data)['encoding']
-            with open(file_path, 'r', encoding=encoding, errors='ignore') as f:
+            text, encoding = read_text(file_path, errors='ignore')
+            with io.StringIO(text, newline=None) as f:
                 lines = [line.replace('\x00', '').replace('\n', ' ').replace('\r', ' ').strip() for line in f if line.strip()]
 
                 csv_reader = csv.reader(lines)
                 headers = next(csv_reader)
+                rows = [row for row in csv_reader if row]
 
-                for row in csv_reader:
-                    if row:
-                        row_description = ", ".join([f"{header}: {value}" for header, value in zip(headers, row)])
-                        row_description = "   ### " + row_description
-                        schema_description += row_description
-
-                        try:
-                            sql = f"select lower(type) from pragma_table_info('{table_name}') where name='{row[0].strip()}';"
-                            cursor.execute(sql)
-                            column_values = cursor.fetchall()
-                            if "blob" in column_values:
-                                schema_description += '\n'
-                            else:
-                                # sql = f"SELECT distinct `{row[0].strip()}` FROM `{table_name}` limit {num_of_sampling};"
-                                sql = f"SELECT distinct substr(`{row[0].strip()}`,1,100) FROM (SELECT `{row[0].strip()}` FROM `{table_name}` limit 1000) limit {num_of_sampling};"
-                                cursor.execute(sql)
-                                column_values = cursor.fetchall()
-                                column_value = ""
-                                for value in column_values:
-                                    column_value += (str(value[0]).replace('\n', ' ') + ", ")
-                                schema_description = schema_description + "   ### column value examples: " + column_value + '\n'
-                        except Exception as e:
-                            schema_description += '\n'
+            column_values = sample_table_values(cursor, table_name, [row[0].strip() for row in rows], num_of_sampling)
+
+            for row in rows:
+                row_description = ", ".join([f"{header}: {value}" for header, value in zip(headers, row)])
+                row_description = "   ### " + row_description
+                schema_description += row_description
+
+                if row[0].strip() in column_values:
+                    column_value = ""
+                    for value in column_values[row[0].strip()]:
+                        column_value += (str(value).replace('\n', ' ') + ", ")
+                    schema_description = schema_description + "   ### column value examples: " + column_value + '\n'
+                else:
+                    schema_description += '\n'
 
         except Exception as e:
             print(f"Warning) Error reading {csv_file}: {e}")
@@ -136,6 +131,7 @@ def read_schema_description(csv_path, db_path, num_of_sampling=30):
 
 class SimilarQuestionFinder:
     def __init__(self, train_json_all, model):
+        from sentence_transformers import SentenceTransformer
         embedding_model_name = model
         self.train_data = [item for item in train_json_all if item["evidence"].lower() not in ["", "false;"] \
             and item["db_id"].lower() not in ["book_publishing_company", "books","hockey","movie_3","movie_4","public_review_platform","soccer_2016","works_cycles"]] # too long db
@@ -146,6 +142,7 @@ class SimilarQuestionFinder:
         self.embeddings = self.model.encode(self.questions, convert_to_tensor=True)
         
     def find_similar_questions(self, target_question, top_k=5):
+        import torch
         target_embedding = self.model.encode([target_question], convert_to_tensor=True)
         similarities = self.model.similarity_pairwise(target_embedding, self.embeddings).squeeze(0)
         top_k_indices = torch.topk(similarities, k=top_k, largest=True).indices
@@ -207,8 +204,16 @@ def concat_schema_and_desc(schema, schema_description):
         print(f"Warning) Error schema concat : {e}")
         return schema
 
+
+def build_schema_context(db_root, db_id, num_of_sampling):
+    schema = generate_schema(f"{db_root}/{db_id}/{db_id}.sqlite")
+    schema_description = read_schema_description(f"{db_root}/{db_id}/database_description", f"{db_root}/{db_id}/{db_id}.sqlite", num_of_sampling)
+    return concat_schema_and_desc(schema, schema_description)
+
 if __name__ == "__main__":
     opt = parse_option()
+    import openai
+    from tqdm import tqdm
     print(opt)
 
     ###settting#####################################################################################
@@ -218,22 +223,20 @@ if __name__ == "__main__":
     ################################################################################################
 
     res = []
-    with open(opt.dataset_json_path, 'rb') as f:
-        raw_data = f.read()
-        encoding = detect(raw_data)['encoding']
-    with open(opt.dataset_json_path, encoding=encoding) as f:
-        question_json_all = json.load(f)
-    with open(opt.train_json_path, encoding=encoding) as f:
-        train_json_all = json.load(f)
+    text, encoding = read_text(opt.dataset_json_path)
+    question_json_all = json.loads(text)
+    text, _ = read_text(opt.train_json_path)
+    train_json_all = json.loads(text)
 
     print("### make evidence start  ###")
     finder = SimilarQuestionFinder(train_json_all, embedding_model_name)
+    schema_store = SchemaStore(opt.schema_store_path) if opt.schema_store_path else None
+    schema_cache = SchemaContextCache(build_schema_context, opt.schema_cache_size, store=schema_store, variant="make_evidence_p29")
+    if opt.schema_context_path:
+        schema_cache.preload(load_schema_contexts(opt.schema_context_path, schema_cache.variant))
 
     for i, data in enumerate(tqdm(question_json_all)):
-        schema = generate_schema(f"{opt.db_path}/{data['db_id']}/{data['db_id']}.sqlite")
-        schema_description = read_schema_description(f"{opt.db_path}/{data['db_id']}/database_description", f"{opt.db_path}/{data['db_id']}/{data['db_id']}.sqlite", 30)
-
-        concat_schema = concat_schema_and_desc(schema, schema_description)
+        concat_schema = schema_cache.get(opt.db_path, data['db_id'], 30)
 
         system_prompt, user_prompt = make_prompt(data["question"], concat_schema)
 
@@ -242,10 +245,7 @@ if __name__ == "__main__":
         similar_questions = finder.find_similar_questions(data['question'], opt.top_n)
         sample_num = 0
         for question, db_id, evidence in similar_questions:
-            train_schema = generate_schema(f"{opt.train_db_path}/{db_id}/{db_id}.sqlite")
-            train_schema_description = read_schema_description(f"{opt.train_db_path}/{db_id}/database_description", f"{opt.train_db_path}/{db_id}/{db_id}.sqlite", 5)
-
-            concat_train_schema = concat_schema_and_desc(train_schema, train_schema_description)
+            concat_train_schema = schema_cache.get(opt.train_db_path, db_id, 5)
 
             sample_num += 1
             # train_sample_assistant = evidence
@@ -292,5 +292,6 @@ if __name__ == "__main__":
             data["text"] = data["evidence"] + " " + data["question"]
         res.append(data)
         
+    print(f"### schema cache: {schema_cache.stats()}")
     with open(opt.output_path, 'w', encoding=encoding) as f:
         json.dump(res, f, indent=2)
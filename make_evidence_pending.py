@@ -1,17 +1,17 @@
 import json
 import argparse
-import openai
-from tqdm import tqdm
 import sqlite3
 import os
-import time
 import csv
-from sentence_transformers import SentenceTransformer
-import torch
 import re
 import jellyfish
+from rate_limiter import shared_limiter, estimate_tokens
+from retry_policy import shared_policy, RetryExhausted
+from response_cache import shared_cache
+from llm_backend import make_backend, OpenAIBackend
 
-openai.api_key = ""
+openai_api_key = ""
+llm = OpenAIBackend("")
 
 def parse_option():
     parser = argparse.ArgumentParser("command line arguments")
@@ -24,6 +24,17 @@ def parse_option():
     parser.add_argument("--dev_table_json_path", type=str)
     parser.add_argument("--train_table_json_path", type=str)
     parser.add_argument("--model", type=str, default="codes")
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--tpm", type=int, default=0)
+    parser.add_argument("--max_attempts", type=int, default=8)
+    parser.add_argument("--max_retry_seconds", type=float, default=600.)
+    parser.add_argument("--response_cache_path", type=str, default="")
+    parser.add_argument("--response_cache_max_mb", type=int, default=1024)
+    parser.add_argument("--response_cache_readonly", action="store_true")
+    parser.add_argument("--llm_backend", type=str, default="openai", choices=["openai", "openai_compatible", "mock"])
+    parser.add_argument("--llm_base_url", type=str, default="")
+    parser.add_argument("--mock_latency", type=float, default=0.)
+    parser.add_argument("--mock_error_rate", type=float, default=0.)
 
     opt = parser.parse_args()
 
@@ -87,13 +98,18 @@ These elements are crucial for comparing the structure of sentences.
 
 
 def generate_reply(input, model_name="gpt-4o-mini"):
-    completions = openai.ChatCompletion.create(
-        model=model_name,
-        messages=input,
-        temperature=0.
-    )
-    
-    return completions.choices[0].message.content
+    response = shared_cache.get(model_name, 0., input)
+    if response is not None:
+        return response
+
+    estimated_tokens = estimate_tokens(input, model_name)
+    shared_limiter.acquire(estimated_tokens)
+    result = llm.chat(input, model_name, temperature=0.)
+    shared_limiter.reconcile(estimated_tokens, result.usage["total_tokens"])
+
+    response = result.content
+    shared_cache.put(model_name, 0., input, response)
+    return response
 
 
 def generate_schema(db_path):
@@ -152,6 +168,7 @@ def read_schema_description(csv_path, db_path, num_of_sampling=10):
 
 class SimilarQuestionFinder:
     def __init__(self, train_json_all, model_name):
+        from sentence_transformers import SentenceTransformer
         self.train_data = [item for item in train_json_all if item["evidence"].lower() not in ["", "false;"]]
         self.questions = [item["question"] for item in self.train_data]
         self.masked_questions = [item["masked_question"] for item in self.train_data]
@@ -161,6 +178,7 @@ class SimilarQuestionFinder:
         self.embeddings = self.model.encode(self.masked_questions, convert_to_tensor=True)
         
     def find_similar_questions(self, target_question, top_k=5):
+        import torch
         target_embedding = self.model.encode([target_question], convert_to_tensor=True)
         distances = torch.cdist(target_embedding, self.embeddings).squeeze(0)
         top_k_indices = torch.topk(distances, k=top_k, largest=False).indices
@@ -261,16 +279,16 @@ def question_masking(json_data, table_json):
 
         prompt = make_keyword_erase_prompt(question, schema_list, value_list)
 
-        response = None
-        while response is None:
-            try:
-                response = generate_reply([{"role": "user", "content": prompt}], model_name="gpt-4o-mini")
-            except Exception as e:
-                print(e)
-                time.sleep(3)
-                pass
-
-        masked_question = extract_json_item("masked_question", response)
+        try:
+            response = shared_policy.call(lambda: generate_reply([{"role": "user", "content": prompt}], model_name="gpt-4o-mini"))
+            masked_question = extract_json_item("masked_question", response)
+        except RetryExhausted as e:
+            print(f"Warning) {e}")
+            masked_question = None
+        if masked_question in [None, "", "Response is not in JSON format", "No masked_question found"]:
+            # the masked question is the retrieval query; a failure text would give every such item the same neighbors
+            print(f"Warning) masking failed, using the unmasked question: {question}")
+            masked_question = question
         data['masked_question'] = masked_question
         
         print(question)
@@ -282,7 +300,13 @@ def question_masking(json_data, table_json):
 
 if __name__ == "__main__":
     opt = parse_option()
+    from tqdm import tqdm
     print(opt)
+    llm = make_backend(opt.llm_backend, openai_api_key, opt.llm_base_url, opt.mock_latency, opt.mock_error_rate)
+    shared_limiter.configure(opt.rpm, opt.tpm)
+    shared_policy.configure(opt.max_attempts, opt.max_retry_seconds)
+    if opt.response_cache_path:
+        shared_cache.open(opt.response_cache_path, opt.response_cache_max_mb * 1024 * 1024, opt.response_cache_readonly)
     res = []
 
     print("### table json process ###")
@@ -357,19 +381,18 @@ if __name__ == "__main__":
 
         prompt = make_prompt(data["question"], concat_schema, train_sample)
 
-        response = None
-        while response is None:
-            try:
-                response = generate_reply([{"role": "user", "content": prompt}], model_name="gpt-4o-mini")
-            except:
-                print('api error, wait for 3 seconds and retry...')
-                time.sleep(3)
-                pass
-
-        data["evidence"] = extract_json_item("evidence", response)
+        try:
+            response = shared_policy.call(lambda: generate_reply([{"role": "user", "content": prompt}], model_name="gpt-4o-mini"))
+            data["evidence"] = extract_json_item("evidence", response)
+        except RetryExhausted as e:
+            print(f"Warning) {e}")
+            data["evidence"] = "Warning) No response from API"
         if opt.model == "codes":
             data["text"] = str(data["evidence"]) + " " + data["question"]
         res.append(data)
         
+    print(f"### rate limiter: {shared_limiter.stats()}")
+    print(f"### retry policy: {shared_policy.stats()}")
+    print(f"### response cache: {shared_cache.stats()}")
     with open(opt.output_path, 'w', encoding='utf-8') as f:
         json.dump(res, f, indent=2)
@@ -0,0 +1,76 @@
+import json
+import os
+
+
+def item_key(index, data):
+    return str(data.get("question_id", index))
+
+
+class JsonlWriter:
+    # one finished item per line; fsync every fsync_every items so a crash loses at most that many
+    def __init__(self, path, resume=False, fsync_every=20):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.pending = 0
+        self.f = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def write(self, index, data, ok=True):
+        # ok=False records an item that got no answer; it is written so the output stays complete, and redone on resume
+        self.f.write(json.dumps({"index": index, "key": item_key(index, data), "data": data, "ok": ok}, ensure_ascii=False) + "\n")
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.pending = 0
+
+    def close(self):
+        self.sync()
+        self.f.close()
+
+
+def load_records(path):
+    # the last record of a key wins, so an item retried on resume replaces its failed record
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line can be cut off by a crash; that item is simply redone
+                continue
+            records[record["key"]] = record
+    return records
+
+
+def load_completed(path):
+    return {key: record for key, record in load_records(path).items() if record.get("ok", True)}
+
+
+def load_failed(path):
+    return sorted((record for record in load_records(path).values() if not record.get("ok", True)), key=lambda record: record["index"])
+
+
+def repair_tail(path):
+    # drop a partially written last line before appending to the file again
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
+
+
+def finalize(jsonl_path, output_path, encoding='utf-8'):
+    records = sorted(load_records(jsonl_path).values(), key=lambda record: record["index"])
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, 'w', encoding=encoding) as f:
+        json.dump([record["data"] for record in records], f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+    return len(records)
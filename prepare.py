@@ -0,0 +1,92 @@
+import argparse
+import importlib
+import json
+import os
+import time
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("precompute schema contexts")
+    parser.add_argument("--db_path", type=str)
+    parser.add_argument("--train_db_path", type=str)
+    parser.add_argument("--output_path", type=str, default="schema_contexts.json")
+    parser.add_argument("--dev_num_of_sampling", type=int, default=30)
+    parser.add_argument("--train_num_of_sampling", type=int, default=5)
+    parser.add_argument("--variant", type=str, default="make_evidence")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--benchmark_workers", type=int, nargs="*", default=[])
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+def list_tasks(opt):
+    tasks = []
+    for db_root, num_of_sampling in [(opt.db_path, opt.dev_num_of_sampling), (opt.train_db_path, opt.train_num_of_sampling)]:
+        if not db_root:
+            continue
+        for db_id in sorted(os.listdir(db_root)):
+            db_file = os.path.join(db_root, db_id, f"{db_id}.sqlite")
+            if os.path.isfile(db_file) and (db_root, db_id, num_of_sampling) not in tasks:
+                tasks.append((db_root, db_id, num_of_sampling))
+    # biggest databases first so one slow database does not end up last in the pool
+    tasks.sort(key=lambda task: -os.path.getsize(os.path.join(task[0], task[1], f"{task[1]}.sqlite")))
+    return tasks
+
+
+def build_entry(variant, db_root, db_id, num_of_sampling):
+    build_schema_context = importlib.import_module(variant).build_schema_context
+    db_file = os.path.abspath(os.path.join(db_root, db_id, f"{db_id}.sqlite"))
+    return {
+        "db_root": db_root,
+        "db_id": db_id,
+        "num_of_sampling": num_of_sampling,
+        "db_file": db_file,
+        "mtime": os.path.getmtime(db_file),
+        "context": build_schema_context(db_root, db_id, num_of_sampling),
+    }
+
+
+def prepare(tasks, variant, num_workers):
+    if num_workers <= 1:
+        return [build_entry(variant, *task) for task in tasks]
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(build_entry, variant, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+
+def load_schema_contexts(path, variant):
+    with open(path, encoding='utf-8') as f:
+        artifact = json.load(f)
+    if artifact["variant"] != variant:
+        print(f"Warning) {path} was prepared for {artifact['variant']}, not {variant}; ignored")
+        return []
+    return artifact["contexts"]
+
+
+if __name__ == "__main__":
+    opt = parse_option()
+    print(opt)
+
+    tasks = list_tasks(opt)
+    print(f"### {len(tasks)} schema contexts to prepare ###")
+
+    base_time = None
+    for num_workers in opt.benchmark_workers:
+        start = time.time()
+        prepare(tasks, opt.variant, num_workers)
+        elapsed = time.time() - start
+        base_time = base_time or elapsed
+        print(f"workers={num_workers}: {elapsed:.2f}s (x{base_time / elapsed:.2f})")
+
+    start = time.time()
+    entries = prepare(tasks, opt.variant, opt.num_workers)
+    print(f"### prepared with {opt.num_workers} workers in {time.time() - start:.2f}s ###")
+
+    tmp_path = opt.output_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"variant": opt.variant, "contexts": entries}, f)
+    os.replace(tmp_path, opt.output_path)
@@ -0,0 +1,102 @@
+import re
+import threading
+from rate_limiter import count_tokens
+
+
+CONTEXT_WINDOWS = {
+    "gpt-4o-mini": 128000,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "o1-preview": 128000,
+    "o1-mini": 128000,
+}
+
+VALUE_EXAMPLES_PATTERN = re.compile(r"   ### column value examples: ([^\n]*)")
+
+
+def context_window(model):
+    for name in sorted(CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(name):
+            return CONTEXT_WINDOWS[name]
+    return 8192
+
+
+def message_tokens(message, model):
+    return count_tokens(message["content"], model) + 4
+
+
+def truncate_value_examples(text, keep):
+    def shorten(match):
+        if keep == 0:
+            return ""
+        values = match.group(1).split(", ")[:-1]
+        return "   ### column value examples: " + "".join(value + ", " for value in values[:keep])
+    return VALUE_EXAMPLES_PATTERN.sub(shorten, text)
+
+
+class PromptBudgeter:
+    def __init__(self, model, reserved_output_tokens=4096, value_steps=(10, 5, 2, 0)):
+        self.model = model
+        self.limit = context_window(model) - reserved_output_tokens
+        self.value_steps = value_steps
+        self.lock = threading.Lock()
+        self.prompts = 0
+        self.trimmed = 0
+        self.dropped_few_shots = 0
+        self.truncated_values = 0
+
+    def fit(self, prompt):
+        # prompt is [system, few-shot 1..n (best first), target]. From the lowest-ranked few-shot up, each one first
+        # gets shorter column value examples and is dropped only when that is not enough; the target's values go last
+        # called from the engine's threads, so the work is counted locally and added to the stats under the lock
+        counts = [message_tokens(message, self.model) for message in prompt]
+        if sum(counts) + 3 <= self.limit:
+            self.record(0, 0)
+            return prompt
+
+        prompt = list(prompt)
+        truncated, dropped = 0, 0
+
+        def shrink(position):
+            nonlocal truncated
+            for keep in self.value_steps:
+                if sum(counts) + 3 <= self.limit:
+                    return
+                content = truncate_value_examples(prompt[position]["content"], keep)
+                if content != prompt[position]["content"]:
+                    truncated += 1
+                    prompt[position] = dict(prompt[position], content=content)
+                    counts[position] = message_tokens(prompt[position], self.model)
+
+        for position in range(len(prompt) - 2, 0, -1):
+            shrink(position)
+            if sum(counts) + 3 <= self.limit:
+                break
+            prompt.pop(position)
+            counts.pop(position)
+            dropped += 1
+        else:
+            shrink(len(prompt) - 1)
+
+        self.record(truncated, dropped, trimmed=True)
+        return prompt
+
+    def record(self, truncated, dropped, trimmed=False):
+        with self.lock:
+            self.prompts += 1
+            self.trimmed += trimmed
+            self.truncated_values += truncated
+            self.dropped_few_shots += dropped
+
+    def stats(self):
+        with self.lock:
+            return {
+                "prompts": self.prompts,
+                "trimmed": self.trimmed,
+                "dropped_few_shots": self.dropped_few_shots,
+                "truncated_values": self.truncated_values,
+                "limit": self.limit,
+            }
@@ -0,0 +1,105 @@
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # a single request bigger than the whole bucket only waits for a full bucket
+        amount = min(amount, self.capacity)
+        return max(0., (amount - self.level) / self.rate)
+
+
+class RateLimiter:
+    def __init__(self, rpm=0, tpm=0):
+        self.lock = threading.Lock()
+        self.configure(rpm, tpm)
+
+    def configure(self, rpm=0, tpm=0):
+        with self.lock:
+            self.request_bucket = TokenBucket(rpm) if rpm else None
+            self.token_bucket = TokenBucket(tpm) if tpm else None
+            self.requests = 0
+            self.estimated_tokens = 0
+            self.actual_tokens = 0
+            self.waited_seconds = 0.
+
+    def acquire(self, estimated_tokens):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = 0.
+                if self.request_bucket is not None:
+                    self.request_bucket.refill(now)
+                    wait = max(wait, self.request_bucket.wait_time(1))
+                if self.token_bucket is not None:
+                    self.token_bucket.refill(now)
+                    wait = max(wait, self.token_bucket.wait_time(estimated_tokens))
+                if wait <= 0.:
+                    if self.request_bucket is not None:
+                        self.request_bucket.level -= 1
+                    if self.token_bucket is not None:
+                        self.token_bucket.level -= estimated_tokens
+                    self.requests += 1
+                    self.estimated_tokens += estimated_tokens
+                    return
+                self.waited_seconds += wait
+            time.sleep(wait)
+
+    def reconcile(self, estimated_tokens, actual_tokens):
+        # charge the bucket with what the API actually counted instead of our estimate
+        with self.lock:
+            self.actual_tokens += actual_tokens
+            if self.token_bucket is not None:
+                self.token_bucket.level = min(self.token_bucket.capacity, self.token_bucket.level + estimated_tokens - actual_tokens)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "estimated_tokens": self.estimated_tokens,
+                "actual_tokens": self.actual_tokens,
+                "waited_seconds": round(self.waited_seconds, 2),
+            }
+
+
+encodings = {}
+
+
+def get_encoding(model):
+    # tiktoken is optional and only imported the first time tokens are counted
+    if model not in encodings:
+        try:
+            import tiktoken
+        except ImportError:
+            encodings[model] = None
+        else:
+            try:
+                encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encodings[model] = tiktoken.get_encoding("o200k_base")
+    return encodings[model]
+
+
+def count_tokens(text, model="gpt-4o"):
+    encoding = get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # rough estimate when tiktoken is not installed
+    return len(text) // 4 + 1
+
+
+def estimate_tokens(messages, model="gpt-4o", completion_tokens=500):
+    return sum(count_tokens(message["content"], model) + 4 for message in messages) + 3 + completion_tokens
+
+
+shared_limiter = RateLimiter()
@@ -0,0 +1,96 @@
+import json
+import re
+import threading
+
+
+def pack_by_db(items, pack_size):
+    # items: [(index, data)]; consecutive chunks of up to pack_size questions of one db_id, databases in first-seen order
+    groups = {}
+    for index, data in items:
+        groups.setdefault(data["db_id"], []).append((index, data))
+    return [members[start:start + pack_size] for members in groups.values() for start in range(0, len(members), pack_size)]
+
+
+def merge_few_shots(similar_lists, limit):
+    # round robin over the members' rankings so every question contributes its best samples first
+    merged, seen = [], set()
+    for rank in range(max((len(similar) for similar in similar_lists), default=0)):
+        for similar in similar_lists:
+            if rank < len(similar) and similar[rank][0] not in seen and len(merged) < limit:
+                seen.add(similar[rank][0])
+                merged.append(similar[rank])
+    return merged
+
+
+ARRAY_PATTERN = re.compile(r"\[.*\]", re.DOTALL)
+OBJECT_PATTERN = re.compile(r'\{(?:[^{}]|(?:\{[^{}]*\}))*\}')
+
+
+def parse_answers(response_content):
+    try:
+        answers = json.loads(response_content)
+    except json.JSONDecodeError:
+        answers = None
+        match = ARRAY_PATTERN.search(response_content)
+        if match:
+            try:
+                answers = json.loads(match.group(0))
+            except json.JSONDecodeError:
+                pass
+        if answers is None:
+            # salvage whatever objects parse on their own, e.g. when the array is cut off
+            answers = []
+            for match in OBJECT_PATTERN.findall(response_content):
+                try:
+                    answers.append(json.loads(match))
+                except json.JSONDecodeError:
+                    continue
+
+    if isinstance(answers, dict):
+        answers = next((value for value in answers.values() if isinstance(value, list)), [answers])
+    return [answer for answer in answers if isinstance(answer, dict)] if isinstance(answers, list) else []
+
+
+def unpack_answers(response_content, count):
+    # -> {position in the group: single-question style response}; questions are numbered from 1 in the prompt
+    unpacked = {}
+    if response_content is None:
+        return unpacked
+    answers = parse_answers(response_content)
+    keyed = all("index" in answer for answer in answers)
+    if not keyed and len(answers) != count:
+        # without indices only a complete answer can be matched up by position
+        return unpacked
+    for position, answer in enumerate(answers):
+        try:
+            n = int(answer["index"]) - 1 if keyed else position
+        except (TypeError, ValueError):
+            continue
+        if 0 <= n < count and n not in unpacked and answer.get("evidence") not in [None, ""]:
+            unpacked[n] = json.dumps({"reasoning": answer.get("reasoning", ""), "evidence": answer["evidence"]}, ensure_ascii=False)
+    return unpacked
+
+
+class PackingStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.items = 0
+        self.packed_items = 0
+        self.fallbacks = 0
+
+    def record(self, items, packed_items):
+        with self.lock:
+            self.requests += 1
+            self.items += items
+            self.packed_items += packed_items
+            self.fallbacks += items - packed_items
+
+    def stats(self):
+        return {
+            "packed_requests": self.requests,
+            "items": self.items,
+            "packed_items": self.packed_items,
+            "fallbacks": self.fallbacks,
+            "requests_saved": self.packed_items - self.requests,
+        }
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def make_key(model, temperature, messages):
+    payload = json.dumps({"model": model, "temperature": temperature, "messages": messages}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conn = None
+        self.readonly = False
+        self.max_bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def open(self, cache_path, max_bytes=None, readonly=False):
+        with self.lock:
+            if readonly:
+                self.conn = sqlite3.connect(f"file:{cache_path}?mode=ro", uri=True, check_same_thread=False)
+            else:
+                self.conn = sqlite3.connect(cache_path, timeout=60, check_same_thread=False)
+                self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created_at REAL, last_used REAL)""")
+                self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+                self.conn.commit()
+            self.readonly = readonly
+            self.max_bytes = max_bytes
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def get(self, model, temperature, messages):
+        if self.conn is None:
+            return None
+        key = make_key(model, temperature, messages)
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.readonly:
+                self.conn.execute("UPDATE responses SET last_used=? WHERE key=?", (time.time(), key))
+                self.conn.commit()
+            return row[0]
+
+    def put(self, model, temperature, messages, response):
+        if self.conn is None or self.readonly:
+            return
+        key = make_key(model, temperature, messages)
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                              (key, model, response, len(response.encode('utf-8')), now, now))
+            if self.max_bytes is not None:
+                self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        # least recently used responses go first once the cache is over its size budget
+        total = self.conn.execute("SELECT coalesce(sum(size), 0) FROM responses").fetchone()[0]
+        while total > self.max_bytes:
+            key, size = self.conn.execute("SELECT key, size FROM responses ORDER BY last_used LIMIT 1").fetchone()
+            self.conn.execute("DELETE FROM responses WHERE key=?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+shared_cache = ResponseCache()
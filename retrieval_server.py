@@ -0,0 +1,170 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class RetrievalClient:
+    # Stand-in for SimilarQuestionFinder that asks a running retrieval server; stdlib only so clients start fast.
+    def __init__(self, url, timeout=600):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def request(self, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = urllib.request.Request(f"{self.url}{path}", data=data, method="POST" if data else "GET")
+        req.add_header("Content-Type", "application/json")
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def health(self):
+        return self.request("/health")
+
+    def iter_similar_questions(self, target_questions, top_k=5, batch_size=256, block_size=1024):
+        for start in range(0, len(target_questions), block_size):
+            response = self.request("/similar", {"questions": target_questions[start:start + block_size], "top_k": top_k})
+            for rows in response["results"]:
+                yield [tuple(row) for row in rows]
+
+    def find_similar_questions_batch(self, target_questions, top_k=5, batch_size=256, block_size=1024):
+        return list(self.iter_similar_questions(target_questions, top_k, batch_size, block_size))
+
+    def find_similar_questions(self, target_question, top_k=5):
+        return self.find_similar_questions_batch([target_question], top_k)[0]
+
+
+class RetrievalState:
+    # Holds the loaded finder and swaps in a new one when the train json changes; queries never wait on a rebuild.
+    def __init__(self, opt):
+        self.opt = opt
+        self.lock = threading.Lock()
+        self.query_lock = threading.Lock()
+        self.finder = None
+        self.corpus = None
+        self.mtime = None
+        self.loaded_at = None
+        self.reloads = 0
+        self.queries = 0
+        self.reload()
+
+    def reload(self):
+        from make_evidence import SimilarQuestionFinder
+        from text_encoding import read_text
+
+        opt = self.opt
+        mtime = os.stat(opt.train_json_path).st_mtime_ns
+        text, _ = read_text(opt.train_json_path)
+        started = time.time()
+        ann_options = {"nlist": opt.ann_nlist, "nprobe": opt.ann_nprobe, "hnsw_ef_search": opt.hnsw_ef_search}
+        finder = SimilarQuestionFinder(json.loads(text), opt.embedding_model_name, opt.embedding_index_dir, opt.embedding_task, opt.ann_index, ann_options,
+                                       opt.retrieval, opt.lexical_index_dir, opt.bm25_include_evidence, opt.fusion, opt.fusion_alpha)
+        with self.lock:
+            self.finder = finder
+            self.corpus = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+            self.mtime = mtime
+            self.loaded_at = time.time()
+            self.reloads += 1
+        print(f"### retrieval server: loaded {len(finder.questions)} train questions (corpus {self.corpus}) in {time.time() - started:.1f}s ###")
+
+    def watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                if os.stat(self.opt.train_json_path).st_mtime_ns != self.mtime:
+                    self.reload()
+            except Exception as e:
+                print(f"Warning) reload failed, keeping the previous index: {e}")
+
+    def similar(self, questions, top_k):
+        with self.lock:
+            finder, corpus = self.finder, self.corpus
+            self.queries += len(questions)
+        with self.query_lock:
+            results = finder.find_similar_questions_batch(questions, top_k, self.opt.retrieval_batch_size, self.opt.retrieval_block_size)
+        return {"results": results, "corpus": corpus}
+
+    def health(self):
+        with self.lock:
+            return {"status": "ok", "corpus": self.corpus, "train_questions": len(self.finder.questions), "loaded_at": self.loaded_at,
+                    "reloads": self.reloads, "queries": self.queries, "retrieval": self.opt.retrieval}
+
+
+def make_handler(state):
+    class RetrievalHandler(BaseHTTPRequestHandler):
+        def reply(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self.reply(200, state.health())
+            else:
+                self.reply(404, {"error": f"unknown path {self.path}"})
+
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path == "/similar":
+                    self.reply(200, state.similar(body["questions"], int(body.get("top_k", 5))))
+                elif self.path == "/reload":
+                    state.reload()
+                    self.reply(200, state.health())
+                else:
+                    self.reply(404, {"error": f"unknown path {self.path}"})
+            except Exception as e:
+                self.reply(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return RetrievalHandler
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("similar question retrieval server")
+    parser.add_argument("--train_json_path", type=str)
+    parser.add_argument("--embedding_model_name", type=str, default="sentence-transformers/all-mpnet-base-v2")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--reload_interval", type=float, default=10.)
+    parser.add_argument("--retrieval_batch_size", type=int, default=256)
+    parser.add_argument("--retrieval_block_size", type=int, default=1024)
+    parser.add_argument("--embedding_index_dir", type=str, default="")
+    parser.add_argument("--embedding_task", type=str, default="")
+    parser.add_argument("--ann_index", type=str, default="exact", choices=["exact", "ivf", "hnsw"])
+    parser.add_argument("--ann_nlist", type=int, default=0)
+    parser.add_argument("--ann_nprobe", type=int, default=8)
+    parser.add_argument("--hnsw_ef_search", type=int, default=64)
+    parser.add_argument("--retrieval", type=str, default="dense", choices=["dense", "hybrid", "lexical"])
+    parser.add_argument("--lexical_index_dir", type=str, default="")
+    parser.add_argument("--bm25_include_evidence", action="store_true")
+    parser.add_argument("--fusion", type=str, default="rrf", choices=["rrf", "weighted"])
+    parser.add_argument("--fusion_alpha", type=float, default=0.5)
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == "__main__":
+    opt = parse_option()
+    state = RetrievalState(opt)
+    if opt.reload_interval > 0:
+        threading.Thread(target=state.watch, args=(opt.reload_interval,), daemon=True).start()
+
+    server = ThreadingHTTPServer((opt.host, opt.port), make_handler(state))
+    print(f"### retrieval server listening on http://{opt.host}:{opt.port} ###")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
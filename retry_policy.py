@@ -0,0 +1,140 @@
+import random
+import threading
+import time
+
+
+RATE_LIMIT = "rate_limit"
+TRANSIENT = "transient"
+CONTEXT_OVERFLOW = "context_overflow"
+FATAL = "fatal"
+
+TRANSIENT_ERRORS = ["TransientError", "APIError", "Timeout", "APITimeoutError", "APIConnectionError", "ServiceUnavailableError", "TryAgain",
+                    "InternalServerError", "ConnectionError", "TimeoutError"]
+FATAL_ERRORS = ["FatalError", "AuthenticationError", "PermissionError", "PermissionDeniedError", "InvalidRequestError", "BadRequestError",
+                "NotFoundError", "SignatureVerificationError"]
+# fatal for every request of the run, not just the one that hit it
+ACCOUNT_ERRORS = ["AuthenticationError", "PermissionError", "PermissionDeniedError", "SignatureVerificationError"]
+
+
+class RetryExhausted(Exception):
+    pass
+
+
+class RequestRejected(RetryExhausted):
+    # a fatal error that only concerns this request (bad request, not found, ...); callers skip the item like an exhausted one
+    pass
+
+
+def is_account_error(e):
+    # LLMError subclasses carry the original error name and status of the client library
+    status = getattr(e, "http_status", None) or getattr(e, "status_code", None)
+    name = getattr(e, "error_name", None) or type(e).__name__
+    return name in ACCOUNT_ERRORS or "insufficient_quota" in str(e) or status in [401, 403]
+
+
+def classify_error(e):
+    name = type(e).__name__
+    message = str(e)
+    if name == "ContextOverflowError" or "maximum context length" in message or "context_length_exceeded" in message:
+        return CONTEXT_OVERFLOW
+    if name == "RateLimitError":
+        # an exhausted quota does not come back by waiting
+        return FATAL if "insufficient_quota" in message else RATE_LIMIT
+    if name in FATAL_ERRORS:
+        return FATAL
+    if name in TRANSIENT_ERRORS:
+        return TRANSIENT
+    status = getattr(e, "http_status", None) or getattr(e, "status_code", None)
+    if status == 429:
+        return RATE_LIMIT
+    if status is not None and 400 <= status < 500:
+        return FATAL
+    return TRANSIENT
+
+
+def retry_after_seconds(e):
+    headers = getattr(e, "headers", None) or {}
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        return float(value) if value is not None else None
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=8, max_total_seconds=600., base_delay=1., max_delay=60.):
+        self.lock = threading.Lock()
+        self.configure(max_attempts, max_total_seconds, base_delay, max_delay)
+
+    def configure(self, max_attempts=8, max_total_seconds=600., base_delay=1., max_delay=60.):
+        with self.lock:
+            self.max_attempts = max_attempts
+            self.max_total_seconds = max_total_seconds
+            self.base_delay = base_delay
+            self.max_delay = max_delay
+            self.retries = {RATE_LIMIT: 0, TRANSIENT: 0, CONTEXT_OVERFLOW: 0, FATAL: 0}
+            self.waited_seconds = 0.
+            self.exhausted = 0
+            self.rejected = 0
+
+    def record(self, kind, waited=0.):
+        with self.lock:
+            self.retries[kind] += 1
+            self.waited_seconds += waited
+
+    def call(self, fn, on_context_overflow=None, deadline=None):
+        # on_context_overflow() shrinks the request and returns False when there is nothing left to drop;
+        # deadline (time.monotonic()) ends the retries early once the caller is no longer waiting for the answer
+        start = time.monotonic()
+        attempts = 0
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                attempts += 1
+                kind = classify_error(e)
+                if kind == FATAL:
+                    self.record(kind)
+                    if is_account_error(e):
+                        raise
+                    with self.lock:
+                        self.rejected += 1
+                    raise RequestRejected(f"request rejected: {e}") from e
+                if kind == CONTEXT_OVERFLOW:
+                    self.record(kind)
+                    if on_context_overflow is not None and on_context_overflow():
+                        continue
+                    with self.lock:
+                        self.exhausted += 1
+                    raise RetryExhausted(f"prompt does not fit the context window: {e}") from e
+
+                elapsed = time.monotonic() - start
+                remaining = self.max_total_seconds - elapsed
+                if deadline is not None:
+                    remaining = min(remaining, deadline - time.monotonic())
+                if attempts >= self.max_attempts or remaining <= 0:
+                    with self.lock:
+                        self.exhausted += 1
+                    raise RetryExhausted(f"gave up after {attempts} attempts and {elapsed:.1f}s: {e}") from e
+
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    # exponential backoff with full jitter
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempts - 1)))
+                delay = min(delay, remaining)
+                print(f'api error ({kind}), retry {attempts} in {delay:.1f} seconds...')
+                print(e)
+                self.record(kind, delay)
+                time.sleep(delay)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "retries": dict(self.retries),
+                "waited_seconds": round(self.waited_seconds, 2),
+                "exhausted": self.exhausted,
+                "rejected": self.rejected,
+            }
+
+
+shared_policy = RetryPolicy()
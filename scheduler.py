@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+
+
+def description_bytes(db_root, db_id):
+    # the column descriptions and value examples dominate a prompt, so their size stands in for its length
+    csv_path = f"{db_root}/{db_id}/database_description"
+    try:
+        return sum(entry.stat().st_size for entry in os.scandir(csv_path) if entry.is_file())
+    except OSError:
+        return 0
+
+
+def schedule_by_db(items, lanes, weight_fn):
+    # items: [(index, data)]. Databases are dealt to `lanes` lanes largest first, each going to the lightest lane,
+    # and the lanes are then interleaved. Every in-flight window of `lanes` requests mixes long and short prompts,
+    # while each database stays contiguous inside its lane so only about `lanes` databases are hot at a time.
+    groups = {}
+    for index, data in items:
+        groups.setdefault(data["db_id"], []).append((index, data))
+
+    weights = {db_id: weight_fn(db_id) for db_id in groups}
+    lane_items = [[] for _ in range(max(1, lanes))]
+    lane_loads = [0] * len(lane_items)
+    for db_id in sorted(groups, key=lambda db_id: (-weights[db_id] * len(groups[db_id]), db_id)):
+        lane = min(range(len(lane_items)), key=lambda lane: (lane_loads[lane], lane))
+        lane_items[lane] += groups[db_id]
+        lane_loads[lane] += (weights[db_id] + 1) * len(groups[db_id])
+
+    scheduled = []
+    for position in range(max((len(lane) for lane in lane_items), default=0)):
+        for lane in lane_items:
+            if position < len(lane):
+                scheduled.append(lane[position])
+    return scheduled
+
+
+def db_switches(items, lanes=1):
+    # how often consecutive work in one lane changes database; lanes=1 looks at the plain sequence
+    switches = 0
+    for lane in range(lanes):
+        db_ids = [data["db_id"] for _, data in items[lane::lanes]]
+        switches += sum(1 for a, b in zip(db_ids, db_ids[1:]) if a != b)
+    return switches
+
+
+class LocalityReport:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = {}
+        self.finished = {}
+        self.items = {}
+
+    def start(self, db_id):
+        with self.lock:
+            self.started.setdefault(db_id, time.perf_counter())
+
+    def finish(self, db_id, count=1):
+        with self.lock:
+            self.finished[db_id] = time.perf_counter()
+            self.items[db_id] = self.items.get(db_id, 0) + count
+
+    def stats(self, top=10):
+        with self.lock:
+            wall = {db_id: self.finished[db_id] - self.started[db_id] for db_id in self.finished if db_id in self.started}
+        slowest = sorted(wall, key=lambda db_id: -wall[db_id])[:top]
+        return {
+            "databases": len(wall),
+            "slowest": [(db_id, self.items[db_id], round(wall[db_id], 2)) for db_id in slowest],
+        }
@@ -0,0 +1,86 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class SchemaContextCache:
+    def __init__(self, build_fn, max_size=128, store=None, variant="make_evidence"):
+        # build_fn(db_root, db_id, num_of_sampling) -> concatenated schema string
+        self.build_fn = build_fn
+        self.max_size = max_size
+        # optional persistent SchemaStore, consulted before building on a miss
+        self.store = store
+        self.variant = variant
+        self.contexts = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self.evictions = 0
+        self.preloaded = 0
+
+    def make_key(self, db_root, db_id, num_of_sampling):
+        db_path = os.path.abspath(f"{db_root}/{db_id}/{db_id}.sqlite")
+        try:
+            mtime = os.path.getmtime(db_path)
+        except OSError:
+            mtime = None
+        return (db_path, mtime, num_of_sampling)
+
+    def put(self, key, context):
+        with self.lock:
+            self.put_locked(key, context)
+
+    def put_locked(self, key, context):
+        self.contexts[key] = context
+        self.contexts.move_to_end(key)
+        if self.max_size is not None and len(self.contexts) > self.max_size:
+            self.contexts.popitem(last=False)
+            self.evictions += 1
+
+    def preload(self, entries):
+        # entries written by prepare.py; a database modified since then simply misses
+        for entry in entries:
+            self.put((entry["db_file"], entry["mtime"], entry["num_of_sampling"]), entry["context"])
+            self.preloaded += 1
+
+    def get(self, db_root, db_id, num_of_sampling):
+        # builds hold the lock, so concurrent callers asking for the same database wait instead of building it twice
+        with self.lock:
+            return self.get_locked(db_root, db_id, num_of_sampling)
+
+    def get_locked(self, db_root, db_id, num_of_sampling):
+        key = self.make_key(db_root, db_id, num_of_sampling)
+        if key in self.contexts:
+            self.hits += 1
+            self.contexts.move_to_end(key)
+            return self.contexts[key]
+
+        self.misses += 1
+        context = None
+        if self.store is not None:
+            context = self.store.get(db_root, db_id, num_of_sampling, self.variant)
+            if context is not None:
+                self.store_hits += 1
+        if context is None:
+            context = self.build_fn(db_root, db_id, num_of_sampling)
+            if self.store is not None:
+                self.store.put(db_root, db_id, num_of_sampling, self.variant, context)
+        self.put_locked(key, context)
+        return context
+
+    def clear(self):
+        self.contexts.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self.contexts),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "store_hits": self.store_hits,
+            "evictions": self.evictions,
+            "preloaded": self.preloaded,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
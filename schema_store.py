@@ -0,0 +1,147 @@
+import argparse
+import hashlib
+import importlib
+import os
+import sqlite3
+import time
+
+
+class SchemaStore:
+    def __init__(self, store_path, readonly=False):
+        self.store_path = store_path
+        self.readonly = readonly
+        # used from the prompt builder thread; SchemaContextCache serializes access
+        self.conn = sqlite3.connect(store_path, timeout=60, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS contexts (
+            key TEXT PRIMARY KEY,
+            db_root TEXT, db_id TEXT, num_of_sampling INTEGER, variant TEXT,
+            context TEXT, created_at REAL, last_used REAL)""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS file_hashes (
+            path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT)""")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def file_hash(self, path):
+        # hashing a large sqlite file is the slow part, so memoize it by (size, mtime)
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return "missing"
+        row = self.conn.execute("SELECT size, mtime_ns, sha256 FROM file_hashes WHERE path=?", (path,)).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        if not self.readonly:
+            self.conn.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)", (path, st.st_size, st.st_mtime_ns, digest))
+            self.conn.commit()
+        return digest
+
+    def make_key(self, db_root, db_id, num_of_sampling, variant):
+        db_dir = os.path.join(db_root, db_id)
+        desc_dir = os.path.join(db_dir, "database_description")
+        parts = [variant, str(num_of_sampling), self.file_hash(os.path.join(db_dir, f"{db_id}.sqlite"))]
+        if os.path.isdir(desc_dir):
+            for csv_file in sorted(os.listdir(desc_dir)):
+                parts.append(f"{csv_file}:{self.file_hash(os.path.join(desc_dir, csv_file))}")
+        return hashlib.sha256("\n".join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, db_root, db_id, num_of_sampling, variant):
+        key = self.make_key(db_root, db_id, num_of_sampling, variant)
+        row = self.conn.execute("SELECT context FROM contexts WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        if not self.readonly:
+            self.conn.execute("UPDATE contexts SET last_used=? WHERE key=?", (time.time(), key))
+            self.conn.commit()
+        return row[0]
+
+    def put(self, db_root, db_id, num_of_sampling, variant, context):
+        if self.readonly:
+            return
+        key = self.make_key(db_root, db_id, num_of_sampling, variant)
+        db_root = os.path.abspath(db_root)
+        now = time.time()
+        # an older entry for the same database and parameters is stale once its inputs changed
+        self.conn.execute("DELETE FROM contexts WHERE db_root=? AND db_id=? AND num_of_sampling=? AND variant=? AND key<>?",
+                          (db_root, db_id, num_of_sampling, variant, key))
+        self.conn.execute("INSERT OR REPLACE INTO contexts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                          (key, db_root, db_id, num_of_sampling, variant, context, now, now))
+        self.conn.commit()
+
+    def entries(self):
+        return self.conn.execute("SELECT key, db_root, db_id, num_of_sampling, variant, length(context), created_at, last_used FROM contexts ORDER BY db_root, db_id, num_of_sampling").fetchall()
+
+    def is_stale(self, key, db_root, db_id, num_of_sampling, variant):
+        if not os.path.isdir(os.path.join(db_root, db_id)):
+            return True
+        return self.make_key(db_root, db_id, num_of_sampling, variant) != key
+
+    def prune(self, max_age_days=None):
+        removed = 0
+        now = time.time()
+        for key, db_root, db_id, num_of_sampling, variant, _, _, last_used in self.entries():
+            too_old = max_age_days is not None and now - last_used > max_age_days * 86400
+            if too_old or self.is_stale(key, db_root, db_id, num_of_sampling, variant):
+                self.conn.execute("DELETE FROM contexts WHERE key=?", (key,))
+                removed += 1
+        for (path,) in self.conn.execute("SELECT path FROM file_hashes").fetchall():
+            if not os.path.exists(path):
+                self.conn.execute("DELETE FROM file_hashes WHERE path=?", (path,))
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+        return removed
+
+
+def list_db_ids(db_root):
+    return sorted(db_id for db_id in os.listdir(db_root) if os.path.isfile(os.path.join(db_root, db_id, f"{db_id}.sqlite")))
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("schema context store")
+    parser.add_argument("command", choices=["warm", "inspect", "prune"])
+    parser.add_argument("--store_path", type=str, default="schema_store.sqlite")
+    parser.add_argument("--db_path", type=str, nargs="*", default=[])
+    parser.add_argument("--num_of_sampling", type=int, nargs="*", default=[30, 5])
+    parser.add_argument("--variant", type=str, default="make_evidence")
+    parser.add_argument("--max_age_days", type=float, default=None)
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == "__main__":
+    opt = parse_option()
+    store = SchemaStore(opt.store_path)
+
+    if opt.command == "warm":
+        build_schema_context = importlib.import_module(opt.variant).build_schema_context
+        for db_root in opt.db_path:
+            for db_id in list_db_ids(db_root):
+                for num_of_sampling in opt.num_of_sampling:
+                    if store.get(db_root, db_id, num_of_sampling, opt.variant) is not None:
+                        continue
+                    start = time.time()
+                    store.put(db_root, db_id, num_of_sampling, opt.variant, build_schema_context(db_root, db_id, num_of_sampling))
+                    print(f"{db_id} ({num_of_sampling}): {time.time() - start:.2f}s")
+
+    elif opt.command == "inspect":
+        total = 0
+        for key, db_root, db_id, num_of_sampling, variant, size, created_at, last_used in store.entries():
+            status = "stale" if store.is_stale(key, db_root, db_id, num_of_sampling, variant) else "ok"
+            print(f"{key[:12]}  {variant}  {db_root}/{db_id}  sampling={num_of_sampling}  chars={size}  last_used={time.strftime('%Y-%m-%d %H:%M', time.localtime(last_used))}  {status}")
+            total += 1
+        print(f"### {total} entries, {os.path.getsize(opt.store_path)} bytes")
+
+    elif opt.command == "prune":
+        print(f"### removed {store.prune(opt.max_age_days)} entries")
+
+    store.close()
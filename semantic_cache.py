@@ -0,0 +1,91 @@
+import json
+import os
+import random
+import threading
+import numpy as np
+
+
+class SemanticEvidenceCache:
+    # Evidence keyed by (db_id, question embedding). A new question reuses the evidence of the closest cached
+    # question on the same database when their cosine similarity reaches the threshold; the LLM is not called.
+    def __init__(self, threshold=0.95, sample_rate=0.05, seed=0):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.matrices = {}
+        self.path = None
+        self.lookups = 0
+        self.hits = 0
+        self.hits_by_source = {}
+        self.samples = []
+
+    def add(self, db_id, question, embedding, evidence, source="generated"):
+        with self.lock:
+            self.entries.setdefault(db_id, []).append((np.asarray(embedding, dtype=np.float32), question, evidence, source))
+            self.matrices.pop(db_id, None)
+            if self.path is not None and source == "generated":
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({"db_id": db_id, "question": question, "evidence": evidence}, ensure_ascii=False) + "\n")
+
+    def add_many(self, db_ids, questions, embeddings, evidences, source):
+        for db_id, question, embedding, evidence in zip(db_ids, questions, embeddings, evidences):
+            self.add(db_id, question, embedding, evidence, source)
+
+    def open(self, path, encode_fn):
+        # generated evidence from earlier runs; embeddings are recomputed with the current model
+        records = []
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        if records:
+            self.add_many([r["db_id"] for r in records], [r["question"] for r in records], encode_fn([r["question"] for r in records]),
+                          [r["evidence"] for r in records], "persisted")
+        self.path = path
+        return len(records)
+
+    def lookup(self, db_id, question, embedding):
+        with self.lock:
+            self.lookups += 1
+            entries = self.entries.get(db_id)
+            if not entries:
+                return None
+            if db_id not in self.matrices:
+                self.matrices[db_id] = np.stack([entry[0] for entry in entries])
+            scores = self.matrices[db_id] @ np.asarray(embedding, dtype=np.float32)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+
+            _, matched_question, evidence, source = entries[best]
+            self.hits += 1
+            self.hits_by_source[source] = self.hits_by_source.get(source, 0) + 1
+            if self.random.random() < self.sample_rate:
+                self.samples.append({"db_id": db_id, "question": question, "matched_question": matched_question,
+                                     "score": round(float(scores[best]), 4), "evidence": evidence, "source": source})
+            return evidence, matched_question, float(scores[best]), source
+
+    def write_samples(self, path):
+        # reused evidences to eyeball: is the matched question really asking the same thing?
+        with self.lock:
+            with open(path, 'w', encoding='utf-8') as f:
+                for sample in self.samples:
+                    f.write(json.dumps(sample, ensure_ascii=False) + "\n")
+            return len(self.samples)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": sum(len(entries) for entries in self.entries.values()),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hits_by_source": dict(self.hits_by_source),
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "threshold": self.threshold,
+                "quality_samples": len(self.samples),
+            }
@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+from output_writer import load_completed, item_key
+from text_encoding import read_text
+
+
+def plan_shards(items, num_shards):
+    # Whole databases are assigned to the least loaded shard, biggest first, so each shard keeps db locality.
+    # A database bigger than a fair share is split into chunks first. Deterministic for a given dataset.
+    groups = defaultdict(list)
+    for index, data in enumerate(items):
+        groups[data["db_id"]].append(index)
+
+    fair_share = max(1, -(-len(items) // num_shards))
+    chunks = []
+    for db_id in sorted(groups):
+        indices = groups[db_id]
+        for start in range(0, len(indices), fair_share):
+            chunks.append((db_id, indices[start:start + fair_share]))
+    chunks.sort(key=lambda chunk: (-len(chunk[1]), chunk[0], chunk[1][0]))
+
+    shards = [[] for _ in range(num_shards)]
+    for db_id, indices in chunks:
+        target = min(range(num_shards), key=lambda shard_index: (len(shards[shard_index]), shard_index))
+        shards[target] += indices
+    return [sorted(shard) for shard in shards]
+
+
+def shard_indices(items, num_shards, shard_index):
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"shard_index must be in [0, {num_shards}), got {shard_index}")
+    return set(plan_shards(items, num_shards)[shard_index])
+
+
+def merge_shards(items, shard_paths):
+    records, duplicates = {}, []
+    for path in shard_paths:
+        for key, record in load_completed(path).items():
+            if key in records:
+                duplicates.append(key)
+            records[key] = record
+
+    merged, missing = [], []
+    for index, data in enumerate(items):
+        key = item_key(index, data)
+        if key in records:
+            merged.append(records[key]["data"])
+        else:
+            missing.append(key)
+    return merged, missing, duplicates
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("dataset sharding")
+    parser.add_argument("command", choices=["plan", "merge"])
+    parser.add_argument("--dataset_json_path", type=str)
+    parser.add_argument("--num_shards", type=int, default=1)
+    parser.add_argument("--shard_paths", type=str, nargs="*", default=[])
+    parser.add_argument("--output_path", type=str)
+    parser.add_argument("--allow_missing", action="store_true")
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == "__main__":
+    opt = parse_option()
+    text, encoding = read_text(opt.dataset_json_path)
+    question_json_all = json.loads(text)
+
+    if opt.command == "plan":
+        for shard_index, indices in enumerate(plan_shards(question_json_all, opt.num_shards)):
+            db_ids = sorted(set(question_json_all[i]["db_id"] for i in indices))
+            print(f"shard {shard_index}: {len(indices)} items, {len(db_ids)} databases ({', '.join(db_ids)})")
+
+    elif opt.command == "merge":
+        merged, missing, duplicates = merge_shards(question_json_all, opt.shard_paths)
+        print(f"### merged {len(merged)} / {len(question_json_all)} items from {len(opt.shard_paths)} shards ###")
+        if duplicates:
+            print(f"Warning) {len(duplicates)} items found in more than one shard: {duplicates[:10]}")
+        if missing:
+            print(f"Warning) {len(missing)} items missing: {missing[:10]}")
+            if not opt.allow_missing:
+                sys.exit(1)
+
+        tmp_path = opt.output_path + ".tmp"
+        with open(tmp_path, 'w', encoding=encoding) as f:
+            json.dump(merged, f, indent=2)
+        os.replace(tmp_path, opt.output_path)
@@ -0,0 +1,62 @@
+import codecs
+import os
+import re
+
+
+BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+MULTIBYTE_ENCODINGS = ["cp949", "euc_kr", "johab", "iso2022_kr", "cp932", "shift_jis", "euc_jp", "iso2022_jp", "gb2312", "gbk", "gb18030",
+                       "big5", "big5hkscs", "utf-16", "utf-32"]
+
+encoding_cache = {}
+
+
+def resolve_encoding(raw_data, prefix_size=64 * 1024):
+    for bom, encoding in BOMS:
+        if raw_data.startswith(bom):
+            return encoding
+    try:
+        raw_data.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    # charset detection is slow on big files and a prefix is usually enough to tell the charsets apart
+    from charset_normalizer import detect
+    encoding = detect(raw_data[:prefix_size])["encoding"]
+    if encoding and decodes(raw_data, encoding) and codecs.lookup(encoding).name != "ascii":
+        return encoding
+
+    # the prefix was plain ASCII, or its guess does not hold for the rest of the file: look at the non-ASCII bytes instead.
+    # A few single-byte characters are easily taken for some other code page, so only a multi-byte guess is trusted there
+    start = re.search(rb"[\x80-\xff]", raw_data).start()
+    encoding = detect(raw_data[start:start + prefix_size])["encoding"]
+    if encoding and decodes(raw_data, encoding) and codecs.lookup(encoding).name in MULTIBYTE_ENCODINGS:
+        return encoding
+    return "cp1252" if decodes(raw_data, "cp1252") else "latin-1"
+
+
+def decodes(raw_data, encoding):
+    try:
+        raw_data.decode(encoding)
+        return True
+    except (UnicodeDecodeError, LookupError):
+        return False
+
+
+def read_text(path, errors="strict", prefix_size=64 * 1024):
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with open(path, 'rb') as f:
+        raw_data = f.read()
+
+    encoding = encoding_cache.get(key)
+    if encoding is None:
+        encoding = resolve_encoding(raw_data, prefix_size)
+        encoding_cache[key] = encoding
+    return raw_data.decode(encoding, errors=errors), encoding